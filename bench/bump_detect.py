@@ -0,0 +1,165 @@
+"""
+BUMP 検知のベンチマーク（DB・Discord 不要）
+
+ギルドのメッセージ列（大半はメンバーの雑談、たまに BUMP 系 Bot の embed）を作って再生し、
+on_message の判定部分だけを旧方式と新方式で比べる。
+
+旧方式：Bot ID をタプルで比較 → embed テキストを組み立てて部分一致 / 正規表現を個別に実行
+        成功のたびに processed_message_ids の dict を全走査して期限切れを掃除
+新方式：bot_id の dict 引きで即リジェクト → サービスごとに1本にまとめた正規表現で判定
+        二重処理防止は TTLSet（期限切れは先頭から捨てるだけ）
+
+    python -m bench.bump_detect
+"""
+import random
+import re
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from utils.bump_providers import detect, load_providers
+from utils.ttl import TTLSet
+
+STREAM_LEN = 200_000
+BOT_RATIO = 0.01        # BUMP 系 Bot の発言の割合
+EMBED_RATIO = 0.1       # 雑談のうちリンクプレビュー等で embed が付く割合
+PROCESSED_BACKLOG = 20_000  # 1時間以内に処理済みのメッセージ数（旧方式の全走査対象）
+
+DISBOARD_BOT_ID = 302050872383242240
+DISSOKU_BOT_ID = 761562078095867916
+
+
+# ------------------------------
+# 旧方式（元の BumpListener の判定部分をそのまま移植）
+# ------------------------------
+DISBOARD_SUCCESS_TEXT = "表示順をアップしたよ"
+DISSOKU_SUCCESS_RE = re.compile(r"をアップしたよ[!！]")
+DISSOKU_NG_WORDS = ("失敗", "間隔をあけてください", "間隔を開けてください")
+
+
+def _embed_text(embed) -> str:
+    parts = []
+    if embed.title:
+        parts.append(embed.title)
+    if embed.description:
+        parts.append(embed.description)
+    for f in getattr(embed, "fields", []) or []:
+        if f.name:
+            parts.append(str(f.name))
+        if f.value:
+            parts.append(str(f.value))
+    return "\n".join(parts)
+
+
+class Legacy:
+    def __init__(self, backlog: dict[int, datetime]):
+        self.processed_message_ids = dict(backlog)
+        self._processed_ttl_sec = 60 * 60
+
+    def _cleanup_processed(self):
+        now = datetime.utcnow()
+        dead = [
+            mid for mid, t in self.processed_message_ids.items()
+            if (now - t).total_seconds() > self._processed_ttl_sec
+        ]
+        for mid in dead:
+            self.processed_message_ids.pop(mid, None)
+
+    def on_message(self, message) -> str | None:
+        if message.author.id not in (DISBOARD_BOT_ID, DISSOKU_BOT_ID):
+            return None
+        provider = "disboard" if message.author.id == DISBOARD_BOT_ID else "dissoku"
+        if not message.embeds:
+            return None
+        embed = message.embeds[0]
+        if provider == "disboard":
+            ok = DISBOARD_SUCCESS_TEXT in _embed_text(embed)
+        else:
+            text = _embed_text(embed)
+            ok = not any(w in text for w in DISSOKU_NG_WORDS) and bool(DISSOKU_SUCCESS_RE.search(text))
+        if not ok:
+            return None
+
+        self._cleanup_processed()
+        if message.id in self.processed_message_ids:
+            return None
+        self.processed_message_ids[message.id] = datetime.utcnow()
+        return provider
+
+
+class Current:
+    def __init__(self, backlog: dict[int, datetime]):
+        self.providers = load_providers()
+        self.processed_message_ids = TTLSet(60 * 60)
+        for mid in backlog:
+            self.processed_message_ids.add(mid)
+
+    def on_message(self, message) -> str | None:
+        provider = detect(self.providers, message.author.id, message.embeds)
+        if provider is None:
+            return None
+        if not self.processed_message_ids.add(message.id):
+            return None
+        return provider.key
+
+
+# ------------------------------
+# メッセージ列
+# ------------------------------
+def _embed(title=None, description=None, fields=()):
+    return SimpleNamespace(
+        title=title,
+        description=description,
+        fields=[SimpleNamespace(name=n, value=v) for n, v in fields],
+    )
+
+
+def make_stream(rng: random.Random) -> list[SimpleNamespace]:
+    bot_embeds = [
+        (DISBOARD_BOT_ID, _embed("DISBOARD: Discordサーバー掲示板", "表示順をアップしたよ :thumbsup:")),
+        (DISBOARD_BOT_ID, _embed("DISBOARD", "上げられるまで、あと 93 分待ってね")),
+        (DISSOKU_BOT_ID, _embed("ディス速", "サーバーをアップしたよ！", [("次回", "2時間後")])),
+        (DISSOKU_BOT_ID, _embed("ディス速", "アップに失敗しました。間隔をあけてください")),
+    ]
+    chatter_embed = _embed("https://example.com", "リンクのプレビュー " * 20)
+
+    stream = []
+    for mid in range(1, STREAM_LEN + 1):
+        if rng.random() < BOT_RATIO:
+            author, embed = rng.choice(bot_embeds)
+            embeds = [embed]
+        else:
+            author = rng.randrange(10**17, 10**18)
+            embeds = [chatter_embed] if rng.random() < EMBED_RATIO else []
+        stream.append(SimpleNamespace(id=10**12 + mid, author=SimpleNamespace(id=author), embeds=embeds))
+    return stream
+
+
+def replay(handler, stream) -> tuple[float, dict[str, int]]:
+    hits: dict[str, int] = {}
+    start = time.perf_counter()
+    for message in stream:
+        provider = handler.on_message(message)
+        if provider:
+            hits[provider] = hits.get(provider, 0) + 1
+    return time.perf_counter() - start, hits
+
+
+def main():
+    rng = random.Random(0)
+    stream = make_stream(rng)
+    now = datetime.utcnow()
+    backlog = {mid: now for mid in range(PROCESSED_BACKLOG)}
+
+    print(f"messages: {STREAM_LEN:,}（Bot {BOT_RATIO:.0%} / 処理済み {PROCESSED_BACKLOG:,} 件）")
+    results = {}
+    for name, cls in (("legacy", Legacy), ("current", Current)):
+        elapsed, hits = replay(cls(backlog), stream)
+        results[name] = hits
+        print(f"{name:<8}: {elapsed * 1000:8.1f} ms  {STREAM_LEN / elapsed:12,.0f} msg/s  {hits}")
+
+    assert results["legacy"] == results["current"], "判定結果が一致しません"
+
+
+if __name__ == "__main__":
+    main()
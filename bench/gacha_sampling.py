@@ -0,0 +1,82 @@
+"""
+未所持ボイメ抽選のベンチマーク（DB不要）
+
+旧方式：gacha_list 全件 + 所持ログ全件を Python に載せて差集合 → random.sample
+新方式：スナップショットのエイリアス表 + 所持済み集合キャッシュから棄却サンプリング
+        （所持済みに偏ったユーザーは未所持だけの表を作って使い回す）
+
+    python -m bench.gacha_sampling
+"""
+import random
+import time
+
+from utils.gacha_sampling import AliasTable, count_unowned, draw_excluding, reject_rate_high
+
+CATALOG_SIZES = (10_000, 100_000)
+OWNED_RATIOS = (0.0, 0.5, 0.9, 0.99)
+PULL_COUNT = 10
+ROUNDS = 200
+
+
+def legacy(all_list: list[dict], owned_rows: list[dict], count: int):
+    owned_ids = {r["gacha_list_id"] for r in owned_rows}
+    available = [r for r in all_list if r["id"] not in owned_ids]
+    if len(available) < count:
+        return None
+    return random.sample(available, count)
+
+
+class UserState:
+    def __init__(self, owned: set[int]):
+        self.owned = owned
+        self.table: AliasTable | None = None
+
+
+def snapshot(items: dict[int, dict], table: AliasTable, user: UserState, count: int):
+    owned = user.owned
+    remaining = len(items) - len(owned)
+    if remaining < count:
+        remaining = count_unowned(items, owned)
+    if remaining < count:
+        return None
+
+    t = user.table or table
+    if reject_rate_high(t, owned):
+        ids = [gid for gid in items if gid not in owned]
+        t = user.table = AliasTable(ids, [items[gid]["weight"] for gid in ids])
+
+    seen: set[int] = set()
+    for _ in range(count):
+        seen.add(draw_excluding(t, owned, seen))
+    return [items[gid] for gid in seen]
+
+
+def timeit(fn, *args) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn(*args)
+    return (time.perf_counter() - start) / ROUNDS * 1000
+
+
+def main():
+    print(f"{'catalog':>8} {'owned':>6} {'legacy ms':>10} {'new ms':>8} {'speedup':>8}")
+    for size in CATALOG_SIZES:
+        all_list = [
+            {"id": i, "user_id": i % 50, "name": f"v{i}", "url": "", "weight": (70.0, 25.0, 5.0)[i % 3]}
+            for i in range(1, size + 1)
+        ]
+        items = {r["id"]: r for r in all_list}
+        ids = list(items)
+        table = AliasTable(ids, [r["weight"] for r in all_list])
+
+        for ratio in OWNED_RATIOS:
+            owned = set(random.sample(ids, int(size * ratio)))
+            owned_rows = [{"gacha_list_id": gid} for gid in owned]
+
+            t_old = timeit(legacy, all_list, owned_rows, PULL_COUNT)
+            t_new = timeit(snapshot, items, table, UserState(owned), PULL_COUNT)
+            print(f"{size:>8} {ratio:>6.0%} {t_old:>10.3f} {t_new:>8.3f} {t_old / t_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
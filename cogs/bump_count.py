@@ -3,29 +3,84 @@
 from __future__ import annotations
 
 import asyncio
-import re
 from datetime import datetime, timedelta
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 
-# =========================
-# Bot IDs
-# =========================
-DISBOARD_BOT_ID = 302050872383242240
-DISSOKU_BOT_ID = 761562078095867916  # ディス速Bot
+from utils import bump_events
+from utils.bump_providers import BumpProvider, detect, load_providers
+from utils.leaderboard import Leaderboard
+from utils.ttl import TTLSet
+
+# サービスごとの Bot ID・判定文言・クールダウンは utils/bump_providers.py
+PROCESSED_TTL_SEC = 60 * 60  # 1時間
 
 # =========================
-# 判定テキスト / クールダウン
+# ランキング
 # =========================
-DISBOARD_SUCCESS_TEXT = "表示順をアップしたよ"
-DISBOARD_COOLDOWN = 60 * 60 * 2  # 2時間
-
-# ディス速：成功文言（半角/全角 ! 対応）
-DISSOKU_COOLDOWN = 60 * 60 * 2  # 2時間
-DISSOKU_SUCCESS_RE = re.compile(r"をアップしたよ[!！]")
-DISSOKU_NG_WORDS = ("失敗", "間隔をあけてください", "間隔を開けてください")
+RANK_PAGE_SIZE = 10
+RANK_META = {
+    "disboard": {
+        "label": "BUMP",
+        "suffix": "（DISBOARD）",
+        "empty": "まだ誰も BUMP してない。静かすぎる。",
+    },
+    "dissoku": {
+        "label": "UP",
+        "suffix": "（ディス速）",
+        "empty": "まだ誰も UP してない。平和すぎる。",
+    },
+}
+# period -> タイトルに付ける表示（"all" は累計 = メモリ上のランキング）
+RANK_PERIODS = {
+    "all": "",
+    "day": "今日の",
+    "week": "今週の",
+    "month": "今月の",
+}
+PERIOD_CHOICES = [
+    app_commands.Choice(name="累計", value="all"),
+    app_commands.Choice(name="今日", value="day"),
+    app_commands.Choice(name="今週", value="week"),
+    app_commands.Choice(name="今月", value="month"),
+]
+
+
+class RankView(discord.ui.View):
+    """ランキングのページ送り（メモリ上のランキングから描画）"""
+
+    def __init__(self, cog: "BumpListener", provider: str, period: str, viewer: discord.abc.User, total: int):
+        super().__init__(timeout=180)
+        self.cog = cog
+        self.provider = provider
+        self.period = period
+        self.viewer = viewer
+        self.total = total
+        self.page = 0
+        self._update_buttons()
+
+    def _update_buttons(self):
+        self.prev_page.disabled = self.page == 0
+        self.next_page.disabled = (self.page + 1) * RANK_PAGE_SIZE >= self.total
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = max(0, self.page - 1)
+        await self._show(interaction)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        await self._show(interaction)
+
+    async def _show(self, interaction: discord.Interaction):
+        embed, self.total = await self.cog.build_rank_embed(
+            interaction.guild, self.viewer, self.provider, self.period, self.page
+        )
+        self._update_buttons()
+        await interaction.response.edit_message(embed=embed, view=self)
 
 
 class BumpListener(commands.Cog):
@@ -34,53 +89,53 @@ class BumpListener(commands.Cog):
         # (channel_id, provider) -> (task, user_id)
         self.scheduled_reminders: dict[tuple[int, str], tuple[asyncio.Task, int | None]] = {}
 
-        # on_message と on_message_edit の二重処理防止
-        self.processed_message_ids: dict[int, datetime] = {}
-        self._processed_ttl_sec = 60 * 60  # 1時間
-
-    def _cleanup_processed(self):
-        now = datetime.utcnow()
-        dead = [
-            mid for mid, t in self.processed_message_ids.items()
-            if (now - t).total_seconds() > self._processed_ttl_sec
-        ]
-        for mid in dead:
-            self.processed_message_ids.pop(mid, None)
+        # bot_id -> サービス定義
+        self.providers: dict[int, BumpProvider] = load_providers()
 
-    # ===============================
-    # embed内テキスト（title + description + fields）
-    # ===============================
-    def _embed_text(self, embed: discord.Embed) -> str:
-        parts: list[str] = []
-        if embed.title:
-            parts.append(embed.title)
-        if embed.description:
-            parts.append(embed.description)
+        # on_message と on_message_edit の二重処理防止
+        self.processed_message_ids = TTLSet(PROCESSED_TTL_SEC)
+
+        # provider -> メモリ上のランキング（起動時に1回だけ読む）
+        self.leaderboards: dict[str, Leaderboard] = {
+            p.key: Leaderboard(p.table) for p in self.providers.values()
+        }
+        # bump_events への書き込みバッファ（cog_load で DB と紐付け）
+        self.events: bump_events.BumpEventBuffer | None = None
+
+    async def cog_load(self):
+        pool = getattr(self.bot, "db", None)
+        if pool is None:
+            return
+        async with pool.acquire() as conn:
+            await bump_events.ensure_schema(conn)
+            for p in self.providers.values():
+                await conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {p.table} ("
+                    "user_id BIGINT PRIMARY KEY, amount INTEGER NOT NULL DEFAULT 0)"
+                )
+        for board in self.leaderboards.values():
+            await board.load(pool)
 
-        for f in getattr(embed, "fields", []) or []:
-            if f.name:
-                parts.append(str(f.name))
-            if f.value:
-                parts.append(str(f.value))
+        self.events = bump_events.BumpEventBuffer(pool)
+        self.flush_events.start()
 
-        return "\n".join(parts)
+    async def cog_unload(self):
+        self.flush_events.cancel()
+        if self.events is not None:
+            await self._flush_events()
 
     # ===============================
-    # 成功判定
+    # bump_events 書き込み（write-behind）
     # ===============================
-    def _is_disboard_success(self, embed: discord.Embed) -> bool:
-        return DISBOARD_SUCCESS_TEXT in self._embed_text(embed)
-
-    def _is_dissoku_success(self, embed: discord.Embed) -> bool:
-        text = self._embed_text(embed)
-
-        if any(w in text for w in DISSOKU_NG_WORDS):
-            return False
-
-        if not DISSOKU_SUCCESS_RE.search(text):
-            return False
+    async def _flush_events(self):
+        try:
+            await self.events.flush()
+        except Exception as e:
+            print(f"❌ bump_events flush error: {e}")
 
-        return True
+    @tasks.loop(seconds=bump_events.FLUSH_INTERVAL_SEC)
+    async def flush_events(self):
+        await self._flush_events()
 
     # ===============================
     # 成功処理（共通）
@@ -88,17 +143,12 @@ class BumpListener(commands.Cog):
     async def _handle_success(
         self,
         message: discord.Message,
-        provider: str,
-        cooldown: int,
-        embed: discord.Embed | None,
+        provider: BumpProvider,
         via: str,  # "message" / "edit"（ログ用途。今は未使用だが将来のため残してOK）
     ):
-        self._cleanup_processed()
-
         # 二重処理防止
-        if message.id in self.processed_message_ids:
+        if not self.processed_message_ids.add(message.id):
             return
-        self.processed_message_ids[message.id] = datetime.utcnow()
 
         # interaction_metadata 優先（DISBOARDと同じ）
         user_id: int | None = None
@@ -110,38 +160,32 @@ class BumpListener(commands.Cog):
         current_amount: int | None = None
         if user_id is not None:
             async with self.bot.db.acquire() as conn:
-                if provider == "dissoku":
-                    row = await conn.fetchrow(
-                        """
-                        INSERT INTO up_amount (user_id, amount)
-                        VALUES ($1, 1)
-                        ON CONFLICT (user_id)
-                        DO UPDATE SET amount = up_amount.amount + 1
-                        RETURNING amount;
-                        """,
-                        user_id
-                    )
-                else:
-                    row = await conn.fetchrow(
-                        """
-                        INSERT INTO bump_amount (user_id, amount)
-                        VALUES ($1, 1)
-                        ON CONFLICT (user_id)
-                        DO UPDATE SET amount = bump_amount.amount + 1
-                        RETURNING amount;
-                        """,
-                        user_id
-                    )
+                row = await conn.fetchrow(
+                    f"""
+                    INSERT INTO {provider.table} (user_id, amount)
+                    VALUES ($1, 1)
+                    ON CONFLICT (user_id)
+                    DO UPDATE SET amount = {provider.table}.amount + 1
+                    RETURNING amount;
+                    """,
+                    user_id
+                )
                 current_amount = row["amount"]
+                self.leaderboards[provider.key].update(user_id, current_amount)
+
+            if self.events is not None:
+                self.events.append(provider.key, user_id, message.channel.id, message.id)
+                if len(self.events) >= bump_events.FLUSH_MAX_EVENTS:
+                    asyncio.create_task(self._flush_events())
 
         # ===== 成功メッセージ =====
-        await self.send_success_embed(message, provider, cooldown, user_id, current_amount)
+        await self.send_success_embed(message, provider, user_id, current_amount)
 
         # ===== リマインド =====
-        key = (message.channel.id, provider)
+        key = (message.channel.id, provider.key)
         if key not in self.scheduled_reminders:
             task = asyncio.create_task(
-                self.bump_reminder(message.guild, message.channel, provider, cooldown, user_id)
+                self.bump_reminder(message.guild, message.channel, provider, user_id)
             )
             self.scheduled_reminders[key] = (task, user_id)
 
@@ -150,39 +194,23 @@ class BumpListener(commands.Cog):
     # ===============================
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
-        if message.author.id not in (DISBOARD_BOT_ID, DISSOKU_BOT_ID):
+        # 対象外の発言者は bot_id の dict 引き1回で弾く（embed無しも無視）
+        provider = detect(self.providers, message.author.id, message.embeds)
+        if provider is None:
             return
 
-        provider = "disboard" if message.author.id == DISBOARD_BOT_ID else "dissoku"
-        cooldown = DISBOARD_COOLDOWN if provider == "disboard" else DISSOKU_COOLDOWN
-
-        # embed無しは無視（ディス速は on_message_edit 側で拾える）
-        if not message.embeds:
-            return
-
-        embed = message.embeds[0]
-        ok = self._is_disboard_success(embed) if provider == "disboard" else self._is_dissoku_success(embed)
-        if not ok:
-            return
-
-        await self._handle_success(message, provider, cooldown, embed, via="message")
+        await self._handle_success(message, provider, via="message")
 
     # ===============================
-    # ディス速：編集で後からembedが付くケースを拾う
+    # 編集で後からembedが付くケース（ディス速など watch_edits のサービス）
     # ===============================
     @commands.Cog.listener()
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
-        if after.author.id != DISSOKU_BOT_ID:
-            return
-
-        if not after.embeds:
+        provider = detect(self.providers, after.author.id, after.embeds, edited=True)
+        if provider is None:
             return
 
-        embed = after.embeds[0]
-        if not self._is_dissoku_success(embed):
-            return
-
-        await self._handle_success(after, "dissoku", DISSOKU_COOLDOWN, embed, via="edit")
+        await self._handle_success(after, provider, via="edit")
 
     # ===============================
     # 成功 Embed
@@ -190,12 +218,11 @@ class BumpListener(commands.Cog):
     async def send_success_embed(
         self,
         message: discord.Message,
-        provider: str,
-        cooldown: int,
+        provider: BumpProvider,
         user_id: int | None,
         amount: int | None
     ):
-        next_time = datetime.utcnow() + timedelta(seconds=cooldown)
+        next_time = datetime.utcnow() + timedelta(seconds=provider.cooldown)
 
         member = (
             message.guild.get_member(user_id)
@@ -205,14 +232,9 @@ class BumpListener(commands.Cog):
 
         mention = member.mention if member else "誰か"
 
-        if provider == "dissoku":
-            action = "/up"
-            title = "🚀 UP 成功！（ディス速）"
-            footer = "ディス速 Up Tracker"
-        else:
-            action = "/bump"
-            title = "🚀 BUMP 成功！（DISBOARD）"
-            footer = "DISBOARD Bump Tracker"
+        action = provider.command
+        title = f"🚀 {provider.label} 成功！（{provider.service}）"
+        footer = provider.footer
 
         amount_text = f"🎉 **{amount} 回目！**" if amount is not None else "🎉 **成功！**"
 
@@ -242,25 +264,19 @@ class BumpListener(commands.Cog):
         self,
         guild: discord.Guild,
         channel: discord.TextChannel,
-        provider: str,
-        cooldown: int,
+        provider: BumpProvider,
         user_id: int | None
     ):
-        key = (channel.id, provider)
+        key = (channel.id, provider.key)
         try:
-            await asyncio.sleep(cooldown)
+            await asyncio.sleep(provider.cooldown)
 
             member = guild.get_member(user_id) if user_id else None
             mention = member.mention if member else "@here"
 
-            if provider == "dissoku":
-                cmd = "`/up`"
-                title = "⏰ UP の時間！（ディス速）"
-                footer = "ディス速 Up Tracker"
-            else:
-                cmd = "</bump:947088344167366698>"
-                title = "⏰ BUMP の時間！（DISBOARD）"
-                footer = "DISBOARD Bump Tracker"
+            cmd = provider.reminder_command
+            title = f"⏰ {provider.label} の時間！（{provider.service}）"
+            footer = provider.footer
 
             embed = discord.Embed(
                 title=title,
@@ -276,130 +292,95 @@ class BumpListener(commands.Cog):
             self.scheduled_reminders.pop(key, None)
 
     # ===============================
-    # /bumprank（DISBOARD）
+    # ランキング Embed（共通）
     # ===============================
-    @app_commands.command(name="bumprank", description="BUMP 回数ランキングを表示します（DISBOARD）")
-    @app_commands.guild_only()
-    async def bump_rank(self, interaction: discord.Interaction):
-        user_id = interaction.user.id
-        guild = interaction.guild
-
-        async with self.bot.db.acquire() as conn:
-            top_rows = await conn.fetch(
-                """
-                SELECT user_id, amount
-                FROM bump_amount
-                ORDER BY amount DESC
-                LIMIT 10;
-                """
-            )
-
-            if not top_rows:
-                await interaction.response.send_message("まだ誰も BUMP してない。静かすぎる。", ephemeral=True)
-                return
-
-            top_user_ids = [r["user_id"] for r in top_rows]
-            is_in_top10 = user_id in top_user_ids
-
-            user_rank_row = None
-            if not is_in_top10:
-                user_rank_row = await conn.fetchrow(
-                    """
-                    SELECT rank, amount FROM (
-                        SELECT user_id, amount, RANK() OVER (ORDER BY amount DESC) AS rank
-                        FROM bump_amount
-                    ) t
-                    WHERE user_id = $1;
-                    """,
-                    user_id
-                )
+    async def _rank_rows(
+        self, provider: str, period: str, page: int, viewer_id: int
+    ) -> tuple[list[tuple[int, int]], int, tuple[int, int] | None]:
+        """(ページの行, 対象人数, 閲覧者の (順位, 回数))。累計はメモリ、期間は bump_rollup から"""
+        offset = page * RANK_PAGE_SIZE
+        if period == "all":
+            board = self.leaderboards[provider]
+            return board.page(offset, RANK_PAGE_SIZE), len(board), board.rank_of(viewer_id)
+
+        # 直近の成功も反映されるよう、先にバッファを流しておく（失敗してもログだけ出して DB の値で表示）
+        if self.events is not None and len(self.events):
+            await self._flush_events()
+        rows, total = await bump_events.period_page(self.bot.db, provider, period, offset, RANK_PAGE_SIZE)
+        ranked = await bump_events.period_rank(self.bot.db, provider, period, viewer_id)
+        return rows, total, ranked
+
+    async def build_rank_embed(
+        self,
+        guild: discord.Guild | None,
+        viewer: discord.abc.User,
+        provider: str,
+        period: str,
+        page: int,
+    ) -> tuple[discord.Embed, int]:
+        meta = RANK_META[provider]
+        offset = page * RANK_PAGE_SIZE
+        rows, total, ranked = await self._rank_rows(provider, period, page, viewer.id)
 
         lines: list[str] = []
-        for i, row in enumerate(top_rows, start=1):
-            member = guild.get_member(row["user_id"]) if guild else None
+        for i, (uid, amount) in enumerate(rows, start=offset + 1):
+            member = guild.get_member(uid) if guild else None
             name = member.display_name if member else "不明な冒険者"
-            mention = member.mention if member else f"<@{row['user_id']}>"
-            lines.append(f"**{i}.** {name}（{mention}） ― `{row['amount']}` 回")
+            mention = member.mention if member else f"<@{uid}>"
+            lines.append(f"**{i}.** {name}（{mention}） ― `{amount}` 回")
 
-        if user_rank_row:
-            member = guild.get_member(user_id)
-            name = member.display_name if member else interaction.user.name
+        if ranked and viewer.id not in {uid for uid, _ in rows}:
+            rank, amount = ranked
+            member = guild.get_member(viewer.id) if guild else None
+            name = member.display_name if member else viewer.name
             lines.append("\n――――――――――")
             lines.append(
-                f"**あなたの順位：{user_rank_row['rank']} 位**\n"
-                f"{name}（{interaction.user.mention}） ― `{user_rank_row['amount']}` 回"
+                f"**あなたの順位：{rank} 位**\n"
+                f"{name}（{viewer.mention}） ― `{amount}` 回"
             )
 
+        label = f"{RANK_PERIODS[period]}{meta['label']}"
+        if page == 0:
+            title = f"🏆 {label} ランキング TOP{RANK_PAGE_SIZE}{meta['suffix']}"
+        else:
+            title = f"🏆 {label} ランキング {offset + 1}〜{offset + len(rows)}位{meta['suffix']}"
+
         embed = discord.Embed(
-            title="🏆 BUMP ランキング TOP10（DISBOARD）",
+            title=title,
             description="\n".join(lines),
             color=discord.Color.gold(),
             timestamp=datetime.utcnow()
         )
-        await interaction.response.send_message(embed=embed)
+        return embed, total
+
+    async def send_rank(self, interaction: discord.Interaction, provider: str, period: str):
+        embed, total = await self.build_rank_embed(interaction.guild, interaction.user, provider, period, 0)
+        if total == 0:
+            await interaction.response.send_message(RANK_META[provider]["empty"], ephemeral=True)
+            return
+
+        view = RankView(self, provider, period, interaction.user, total)
+        await interaction.response.send_message(embed=embed, view=view)
+
+    # ===============================
+    # /bumprank（DISBOARD）
+    # ===============================
+    @app_commands.command(name="bumprank", description="BUMP 回数ランキングを表示します（DISBOARD）")
+    @app_commands.describe(period="集計期間（省略時は累計）")
+    @app_commands.choices(period=PERIOD_CHOICES)
+    @app_commands.guild_only()
+    async def bump_rank(self, interaction: discord.Interaction, period: app_commands.Choice[str] | None = None):
+        await self.send_rank(interaction, "disboard", period.value if period else "all")
 
     # ===============================
     # /uprank（ディス速）
     # ===============================
     @app_commands.command(name="uprank", description="UP 回数ランキングを表示します（ディス速）")
+    @app_commands.describe(period="集計期間（省略時は累計）")
+    @app_commands.choices(period=PERIOD_CHOICES)
     @app_commands.guild_only()
-    async def up_rank(self, interaction: discord.Interaction):
-        user_id = interaction.user.id
-        guild = interaction.guild
-
-        async with self.bot.db.acquire() as conn:
-            top_rows = await conn.fetch(
-                """
-                SELECT user_id, amount
-                FROM up_amount
-                ORDER BY amount DESC
-                LIMIT 10;
-                """
-            )
-
-            if not top_rows:
-                await interaction.response.send_message("まだ誰も UP してない。平和すぎる。", ephemeral=True)
-                return
-
-            top_user_ids = [r["user_id"] for r in top_rows]
-            is_in_top10 = user_id in top_user_ids
-
-            user_rank_row = None
-            if not is_in_top10:
-                user_rank_row = await conn.fetchrow(
-                    """
-                    SELECT rank, amount FROM (
-                        SELECT user_id, amount, RANK() OVER (ORDER BY amount DESC) AS rank
-                        FROM up_amount
-                    ) t
-                    WHERE user_id = $1;
-                    """,
-                    user_id
-                )
-
-        lines: list[str] = []
-        for i, row in enumerate(top_rows, start=1):
-            member = guild.get_member(row["user_id"]) if guild else None
-            name = member.display_name if member else "不明な冒険者"
-            mention = member.mention if member else f"<@{row['user_id']}>"
-            lines.append(f"**{i}.** {name}（{mention}） ― `{row['amount']}` 回")
-
-        if user_rank_row:
-            member = guild.get_member(user_id)
-            name = member.display_name if member else interaction.user.name
-            lines.append("\n――――――――――")
-            lines.append(
-                f"**あなたの順位：{user_rank_row['rank']} 位**\n"
-                f"{name}（{interaction.user.mention}） ― `{user_rank_row['amount']}` 回"
-            )
-
-        embed = discord.Embed(
-            title="🏆 UP ランキング TOP10（ディス速）",
-            description="\n".join(lines),
-            color=discord.Color.gold(),
-            timestamp=datetime.utcnow()
-        )
-        await interaction.response.send_message(embed=embed)
+    async def up_rank(self, interaction: discord.Interaction, period: app_commands.Choice[str] | None = None):
+        await self.send_rank(interaction, "dissoku", period.value if period else "all")
 
 
 async def setup(bot: commands.Bot):
@@ -1,8 +1,13 @@
-import random
+import io
+import time
+from collections import OrderedDict
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ui import View, Button
+from utils.gacha_catalog import GachaCatalog, OwnedCache, item_weight, rarity_name
+from utils import gacha_audit, gacha_partition, wallet_ledger
+from utils.embed_pages import pack_embeds
 
 # ==============================
 # 定数
@@ -11,9 +16,115 @@ GACHA_PRICE_SINGLE = 500
 GACHA_PRICE_TEN = 4500
 PROVIDER_REWARD = 300
 
+# まとめ引き（1回分は10連と同じ単価）
+GACHA_BULK_COUNT = 50
+GACHA_PRICE_BULK = GACHA_PRICE_TEN // 10 * GACHA_BULK_COUNT
+
+GACHA_PRICES = {
+    1: GACHA_PRICE_SINGLE,
+    10: GACHA_PRICE_TEN,
+    GACHA_BULK_COUNT: GACHA_PRICE_BULK,
+}
+
+# 結果DMの1ページあたりの件数（Embed のフィールド上限 25 より小さく）
+RESULT_PAGE_SIZE = 10
+# ログ Embed の説明文上限（Discord は 4096 文字。1メッセージの合計上限は embed_pages 側で守る）
+LOG_EMBED_CHARS = 4000
+
+# 天井：最上位レアリティを引かずにこの回数に達したら、その回は最上位から引く
+GACHA_PITY_THRESHOLD = 50
+
+# 同一ユーザーの連打対策：実行中 + 完了後この秒数は重複として弾く
+GACHA_DEDUPE_WINDOW_SEC = 2.0
+
+# 一覧表示：1ページの件数 / ページキャッシュの上限
+BROWSE_PAGE_SIZE = 10
+BROWSE_CACHE_PAGES = 32
+
 EMBED_COLOR = 0x9B59B6
 GACHA_LOG_TC_ID = 1461102916181164143
 
+# 集計テーブル（ガチャ実行と同じトランザクションで更新）
+COUNTER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS gacha_owned_by_owner (
+    buyer_id BIGINT NOT NULL,
+    owner_id BIGINT NOT NULL,
+    owned_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (buyer_id, owner_id)
+);
+CREATE TABLE IF NOT EXISTS gacha_buyer_totals (
+    buyer_id BIGINT PRIMARY KEY,
+    owned_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS gacha_provider_pulls (
+    provider_id BIGINT PRIMARY KEY,
+    pull_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- ボイメの削除・提供者変更をその場で集計へ反映する。
+-- BEFORE にしておくと、gacha_log が外部キーで連鎖削除される場合でも引いた記録を数えられる
+CREATE OR REPLACE FUNCTION gacha_list_adjust_counters() RETURNS trigger AS $$
+DECLARE
+    buyers BIGINT[];
+    counts INTEGER[];
+    moved INTEGER;
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.user_id IS NOT DISTINCT FROM OLD.user_id THEN
+        RETURN NEW;
+    END IF;
+
+    SELECT array_agg(user_id ORDER BY user_id), array_agg(n ORDER BY user_id), SUM(n)
+    INTO buyers, counts, moved
+    FROM (
+        SELECT user_id, SUM(draws)::int AS n
+        FROM (
+            SELECT user_id, 1 AS draws FROM gacha_log WHERE gacha_list_id = OLD.id
+            UNION ALL
+            SELECT user_id, draws FROM gacha_log_archive WHERE gacha_list_id = OLD.id
+        ) d
+        GROUP BY user_id
+    ) per_buyer;
+
+    IF buyers IS NOT NULL THEN
+        -- 所持数は (購入者, 提供者) ごとにボイメ1件 = 1
+        INSERT INTO gacha_owned_by_owner (buyer_id, owner_id, owned_count)
+        SELECT b, OLD.user_id, -1 FROM unnest(buyers) AS b
+        UNION ALL
+        SELECT b, NEW.user_id, 1 FROM unnest(buyers) AS b WHERE TG_OP = 'UPDATE'
+        ORDER BY 1, 2
+        ON CONFLICT (buyer_id, owner_id)
+        DO UPDATE SET owned_count = gacha_owned_by_owner.owned_count + EXCLUDED.owned_count;
+
+        -- 提供者別の回数は台帳に未反映の分があるので差分で積む（負になっても台帳と足せば正しい）
+        INSERT INTO gacha_provider_pulls (provider_id, pull_count)
+        SELECT OLD.user_id, -moved
+        UNION ALL
+        SELECT NEW.user_id, moved WHERE TG_OP = 'UPDATE'
+        ORDER BY 1
+        ON CONFLICT (provider_id)
+        DO UPDATE SET pull_count = gacha_provider_pulls.pull_count + EXCLUDED.pull_count;
+
+        IF TG_OP = 'DELETE' THEN
+            UPDATE gacha_buyer_totals t
+            SET owned_count = t.owned_count - d.n
+            FROM unnest(buyers, counts) AS d(buyer_id, n)
+            WHERE t.buyer_id = d.buyer_id;
+        END IF;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS gacha_list_counters ON gacha_list;
+CREATE TRIGGER gacha_list_counters
+BEFORE DELETE OR UPDATE OF user_id ON gacha_list
+FOR EACH ROW EXECUTE FUNCTION gacha_list_adjust_counters();
+"""
+
 # ==============================
 # 永続View
 # ==============================
@@ -30,6 +141,10 @@ class GachaView(View):
     async def ten(self, interaction: discord.Interaction, button: Button):
         await self.cog.run_gacha(interaction, count=10)
 
+    @discord.ui.button(label=f"💯 {GACHA_BULK_COUNT}連", style=discord.ButtonStyle.secondary, custom_id="gacha:bulk")
+    async def bulk(self, interaction: discord.Interaction, button: Button):
+        await self.cog.run_gacha(interaction, count=GACHA_BULK_COUNT)
+
     @discord.ui.button(label="📈 コンプ率", style=discord.ButtonStyle.secondary, custom_id="gacha:completion")
     async def comp(self, interaction: discord.Interaction, button: Button):
         await self.cog.show_completion(interaction)
@@ -38,22 +153,357 @@ class GachaView(View):
     async def provider(self, interaction: discord.Interaction, button: Button):
         await self.cog.show_provider_income(interaction)
 
+    @discord.ui.button(label="📖 一覧", style=discord.ButtonStyle.secondary, custom_id="gacha:browse")
+    async def browse(self, interaction: discord.Interaction, button: Button):
+        await self.cog.show_browse(interaction)
+
+# ==============================
+# 結果DMのページ送り（メモリ上の結果から描画）
+# ==============================
+class GachaResultView(View):
+    def __init__(self, guild: discord.Guild, results: list, before_balance: int, after_balance: int):
+        super().__init__(timeout=600)
+        self.guild = guild
+        self.results = results
+        self.balance_text = f"残高：{before_balance}G → {after_balance}G"
+        self.page = 0
+        self.pages = max(1, -(-len(results) // RESULT_PAGE_SIZE))
+        self._update_buttons()
+
+    def build_embed(self) -> discord.Embed:
+        embed = discord.Embed(
+            title=f"🎰 ガチャ結果（{len(self.results)}件）",
+            color=EMBED_COLOR
+        )
+
+        start = self.page * RESULT_PAGE_SIZE
+        for gacha in self.results[start:start + RESULT_PAGE_SIZE]:
+            member = self.guild.get_member(gacha["user_id"])
+            name = gacha["name"] or "名称不明"
+            url = gacha["url"] or "https://example.com"
+            display = member.display_name if member else "退会済み"
+            mention = member.mention if member else f"<@{gacha['user_id']}>"
+
+            embed.add_field(
+                name=f"🎙 ボイメNo.{gacha['id']}（{rarity_name(gacha)}）",
+                value=f"[{name}]({url})\nvoiced by {mention}（{display}）",
+                inline=False
+            )
+
+            if member and not embed.author.name:
+                embed.set_author(
+                    name=display,
+                    icon_url=member.display_avatar.url
+                )
+
+        if self.pages > 1:
+            embed.set_footer(text=f"{self.page + 1}/{self.pages}ページ")
+        return embed
+
+    def _update_buttons(self):
+        self.prev_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.pages - 1
+
+    async def _show(self, interaction: discord.Interaction):
+        self._update_buttons()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: Button):
+        self.page = max(0, self.page - 1)
+        await self._show(interaction)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        self.page = min(self.pages - 1, self.page + 1)
+        await self._show(interaction)
+
+# ==============================
+# 一覧View（ユーザーごと・一時）
+# ==============================
+BROWSE_OWNED_FILTERS = {
+    "all": "すべて",
+    "owned": "所持のみ",
+    "unowned": "未所持のみ",
+}
+
+
+class GachaBrowseView(View):
+    """
+    gacha_list を id のキーセットでページ送りする。所持判定は OwnedCache（メモリ）で行い、
+    「所持のみ」は所持 id から辿るので、どのフィルタもカタログの大きさに依らない費用で1ページ取れる。
+    描画済みページは (フィルタ, 開始id, 所持数) ごとに LRU で持つので、戻る/進むの再訪はDBに行かない。
+    """
+
+    def __init__(self, cog, viewer_id: int):
+        super().__init__(timeout=180)
+        self.cog = cog
+        self.viewer_id = viewer_id
+        self.owned_filter = "all"
+        self.provider_id: int | None = None
+        # 各ページの開始位置（直前ページの末尾id）。末尾が現在のページ
+        self.cursors: list[int] = [0]
+        self._pages: OrderedDict[tuple, tuple[discord.Embed, int | None]] = OrderedDict()
+
+        self.owned_select = discord.ui.Select(
+            placeholder="所持フィルタ",
+            options=[discord.SelectOption(label=label, value=value) for value, label in BROWSE_OWNED_FILTERS.items()],
+            row=0,
+        )
+        self.owned_select.callback = self.on_owned_select  # type: ignore
+        self.add_item(self.owned_select)
+
+        self.provider_select = discord.ui.UserSelect(placeholder="提供者で絞り込み", row=1)
+        self.provider_select.callback = self.on_provider_select  # type: ignore
+        self.add_item(self.provider_select)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.user.id == self.viewer_id
+
+    # ------------------------------
+    # ページ取得
+    # ------------------------------
+    async def _fetch_page(self, cursor: int) -> tuple[discord.Embed, int | None]:
+        # 所持がメモリにあれば、キャッシュ判定まで DB に触らない
+        owned = self.cog.owned.peek(self.viewer_id)
+        if owned is None:
+            async with self.cog.pool.acquire() as conn:
+                owned = await self.cog.owned.get(conn, self.viewer_id)
+
+        # 所持は増える一方なので件数で見分ける（ガチャを引いたらキャッシュ済みページは使わない）
+        key = (self.cog.catalog.version, len(owned.ids), self.owned_filter, self.provider_id, cursor)
+        page = self._pages.get(key)
+        if page is not None:
+            self._pages.move_to_end(key)
+            return page
+
+        if self.owned_filter == "owned":
+            rows = self._owned_rows(owned.ids, cursor)
+        else:
+            # 未所持は所持 id を除くだけ（飛ばす行は所持数まで）
+            owned_cond = "AND g.id <> ALL($4::bigint[])" if self.owned_filter == "unowned" else "AND $4::bigint[] IS NULL"
+            # 提供者条件は文字列側で切り替える（汎用プランで索引を外さないように）
+            provider_cond = "AND g.user_id = $2" if self.provider_id is not None else "AND $2::bigint IS NULL"
+            async with self.cog.pool.acquire() as conn:
+                rows = await conn.fetch(
+                    f"""
+                    SELECT g.id, g.user_id, g.name, g.url, g.rarity
+                    FROM gacha_list g
+                    WHERE g.id > $1
+                      {provider_cond}
+                      {owned_cond}
+                    ORDER BY g.id
+                    LIMIT $3
+                    """,
+                    cursor, self.provider_id, BROWSE_PAGE_SIZE + 1,
+                    list(owned.ids) if self.owned_filter == "unowned" else None
+                )
+
+        next_cursor = rows[BROWSE_PAGE_SIZE - 1]["id"] if len(rows) > BROWSE_PAGE_SIZE else None
+        page = (self._render(rows[:BROWSE_PAGE_SIZE], owned.ids), next_cursor)
+
+        self._pages[key] = page
+        if len(self._pages) > BROWSE_CACHE_PAGES:
+            self._pages.popitem(last=False)
+        return page
+
+    def _owned_rows(self, owned_ids: set[int], cursor: int) -> list:
+        """所持 id を小さい順に辿り、スナップショットから行を取る（DB は見ない）"""
+        catalog = self.cog.catalog
+        rows = []
+        for gid in sorted(gid for gid in owned_ids if gid > cursor):
+            item = catalog.get(gid)
+            if item is None or (self.provider_id is not None and item["user_id"] != self.provider_id):
+                continue
+            rows.append(item)
+            if len(rows) > BROWSE_PAGE_SIZE:
+                break
+        return rows
+
+    def _render(self, rows, owned_ids: set[int]) -> discord.Embed:
+        filters = [BROWSE_OWNED_FILTERS[self.owned_filter]]
+        if self.provider_id is not None:
+            filters.append(f"提供者：<@{self.provider_id}>")
+
+        lines = [
+            f"{'✅' if r['id'] in owned_ids else '⬜'} No.{r['id']}（{rarity_name(r)}）"
+            f"[{r['name'] or '名称不明'}]({r['url'] or 'https://example.com'}) ― <@{r['user_id']}>"
+            for r in rows
+        ]
+        embed = discord.Embed(
+            title="📖 ボイメ一覧",
+            color=EMBED_COLOR,
+            description="\n".join(lines) if lines else "該当するボイメがない。"
+        )
+        embed.set_footer(text=f"{' / '.join(filters)}｜{len(self.cursors)}ページ目")
+        return embed
+
+    async def render_current(self) -> discord.Embed:
+        embed, next_cursor = await self._fetch_page(self.cursors[-1])
+        self.prev_page.disabled = len(self.cursors) <= 1
+        self.next_page.disabled = next_cursor is None
+        return embed
+
+    async def _refresh(self, interaction: discord.Interaction):
+        embed = await self.render_current()
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    # ------------------------------
+    # 操作
+    # ------------------------------
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary, row=2)
+    async def prev_page(self, interaction: discord.Interaction, button: Button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        await self._refresh(interaction)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary, row=2)
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        _, next_cursor = await self._fetch_page(self.cursors[-1])
+        if next_cursor is not None:
+            self.cursors.append(next_cursor)
+        await self._refresh(interaction)
+
+    @discord.ui.button(label="提供者解除", style=discord.ButtonStyle.secondary, row=2)
+    async def clear_provider(self, interaction: discord.Interaction, button: Button):
+        self.provider_id = None
+        self.cursors = [0]
+        await self._refresh(interaction)
+
+    async def on_owned_select(self, interaction: discord.Interaction):
+        self.owned_filter = self.owned_select.values[0]
+        self.cursors = [0]
+        await self._refresh(interaction)
+
+    async def on_provider_select(self, interaction: discord.Interaction):
+        self.provider_id = self.provider_select.values[0].id
+        self.cursors = [0]
+        await self._refresh(interaction)
+
 # ==============================
 # COG
 # ==============================
 class GachaCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.pool = bot.db
-    
+        self.pool = getattr(bot, "db", None)
+        self.catalog = GachaCatalog(self.pool)
+        self.owned = OwnedCache()
+
+        # 連打ガード（user_id -> 開始時刻 / 完了時刻）
+        self._inflight: dict[int, float] = {}
+        self._recent: dict[int, float] = {}
+        self.duplicate_pulls = 0
+
         bot.add_view(GachaView(self))
 
+    async def cog_load(self):
+        if self.pool is None:
+            return
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS gacha_log_user_item_idx "
+                "ON gacha_log (user_id, gacha_list_id)"
+            )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS gacha_list_user_id_idx "
+                "ON gacha_list (user_id, id)"
+            )
+            await conn.execute(COUNTER_SCHEMA)
+            await wallet_ledger.ensure_schema(conn)
+            await gacha_partition.ensure_schema(conn)
+            await conn.execute(
+                """
+                ALTER TABLE gacha_list
+                    ADD COLUMN IF NOT EXISTS rarity SMALLINT NOT NULL DEFAULT 1,
+                    ADD COLUMN IF NOT EXISTS weight REAL;
+                ALTER TABLE wallet
+                    ADD COLUMN IF NOT EXISTS pity INTEGER NOT NULL DEFAULT 0;
+                """
+            )
+            empty = await conn.fetchval(
+                "SELECT NOT EXISTS (SELECT 1 FROM gacha_buyer_totals) "
+                "AND (EXISTS (SELECT 1 FROM gacha_log) OR EXISTS (SELECT 1 FROM gacha_log_archive))"
+            )
+        if empty:
+            await self.rebuild_counters()
+        await self.catalog.start()
+        self.compact_wallet.start()
+        self.maintain_log_partitions.start()
+
+    async def cog_unload(self):
+        self.compact_wallet.cancel()
+        self.maintain_log_partitions.cancel()
+        await self.catalog.stop()
+
+    # ------------------------------
+    # gacha_log のパーティション保守（先の月を作成・古い月を集約して切り離し）
+    # ------------------------------
+    @tasks.loop(hours=24)
+    async def maintain_log_partitions(self):
+        try:
+            async with self.pool.acquire() as conn:
+                await gacha_partition.ensure_partitions(conn)
+            await gacha_partition.archive_old(self.pool)
+        except Exception as e:
+            print(f"❌ gacha_log partition maintenance error: {e}")
+
+    # ------------------------------
+    # 提供者クレジットの畳み込み
+    # ------------------------------
+    @tasks.loop(seconds=5)
+    async def compact_wallet(self):
+        try:
+            while await wallet_ledger.compact(self.pool) > 0:
+                pass
+        except Exception as e:
+            print(f"❌ wallet compact error: {e}")
+
+    async def rebuild_counters(self):
+        """
+        gacha_log（集約済み分を含む）と今の gacha_list から集計テーブルを作り直す。
+        ボイメの削除・提供者変更は gacha_list のトリガーが反映するので、普段は不要（ずれた時の修復用）。
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("LOCK TABLE gacha_log, gacha_log_archive, gacha_list IN SHARE MODE")
+                await conn.execute("LOCK TABLE wallet_credit_ledger IN SHARE ROW EXCLUSIVE MODE")
+                await conn.execute(
+                    """
+                    UPDATE wallet_credit_ledger SET pulls = 0 WHERE pulls <> 0;
+
+                    TRUNCATE gacha_owned_by_owner, gacha_buyer_totals, gacha_provider_pulls;
+
+                    CREATE TEMP TABLE all_draws ON COMMIT DROP AS
+                    """ + gacha_partition.ALL_DRAWS_SQL + """;
+
+                    INSERT INTO gacha_owned_by_owner (buyer_id, owner_id, owned_count)
+                    SELECT g.user_id, gl.user_id, COUNT(DISTINCT gl.id)
+                    FROM all_draws g
+                    JOIN gacha_list gl ON gl.id = g.gacha_list_id
+                    GROUP BY g.user_id, gl.user_id;
+
+                    INSERT INTO gacha_buyer_totals (buyer_id, owned_count)
+                    SELECT g.user_id, SUM(g.draws)
+                    FROM all_draws g
+                    JOIN gacha_list gl ON gl.id = g.gacha_list_id
+                    GROUP BY g.user_id;
+
+                    INSERT INTO gacha_provider_pulls (provider_id, pull_count)
+                    SELECT gl.user_id, SUM(g.draws)
+                    FROM all_draws g
+                    JOIN gacha_list gl ON gl.id = g.gacha_list_id
+                    GROUP BY gl.user_id;
+                    """
+                )
+        print("✅ ガチャ集計テーブルを再構築しました。")
+
     # ------------------------------
     # 安全DM
     # ------------------------------
-    async def safe_dm(self, user: discord.User, *, content=None, embed=None):
+    async def safe_dm(self, user: discord.User, *, content=None, embed=None, view=None):
         try:
-            await user.send(content=content, embed=embed)
+            await user.send(content=content, embed=embed, view=view)
             return True
         except discord.Forbidden:
             return False
@@ -71,28 +521,163 @@ class GachaCog(commands.Cog):
                 "ボタンを押すとDMで結果が届く。\n\n"
                 "🎱 単発：500G\n"
                 "🎉 10連：4,500G\n"
+                f"💯 {GACHA_BULK_COUNT}連：{GACHA_PRICE_BULK:,}G\n"
                 "📈 コンプ率\n"
-                "💰 提供者収益"
+                "💰 提供者収益\n"
+                "📖 ボイメ一覧"
             )
         )
 
         await interaction.response.send_message("設置完了。", ephemeral=True)
         await interaction.channel.send(embed=embed, view=GachaView(self))
 
+    # ------------------------------
+    # /ガチャ状況
+    # ------------------------------
+    @app_commands.command(name="ガチャ状況", description="ガチャの内部状況を表示（管理者限定）")
+    @app_commands.default_permissions(administrator=True)
+    async def gacha_status(self, interaction: discord.Interaction):
+        await interaction.response.send_message(
+            f"実行中：{len(self._inflight)}件\n"
+            f"連打で弾いた回数：{self.duplicate_pulls}回",
+            ephemeral=True
+        )
+
+    # ------------------------------
+    # /ガチャ再集計
+    # ------------------------------
+    @app_commands.command(name="ガチャ再集計", description="コンプ率・提供者の集計を元データから数え直す（管理者限定）")
+    @app_commands.default_permissions(administrator=True)
+    async def gacha_rebuild(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        started = time.monotonic()
+        try:
+            await self.rebuild_counters()
+        except Exception as e:
+            print(f"❌ gacha counter rebuild error: {e}")
+            await interaction.followup.send("❌ 数え直しに失敗しました。", ephemeral=True)
+            return
+        await interaction.followup.send(
+            f"✅ ガチャ集計テーブルを数え直しました。（{time.monotonic() - started:.1f}秒）",
+            ephemeral=True
+        )
+
+    # ------------------------------
+    # /ガチャ監査
+    # ------------------------------
+    @app_commands.command(name="ガチャ監査", description="ガチャ抽選の偏りを検定（管理者限定）")
+    @app_commands.default_permissions(administrator=True)
+    async def gacha_audit(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+
+        items = list(self.catalog.items.values())
+        started = time.monotonic()
+        try:
+            result = await gacha_audit.run_audit(
+                self.pool,
+                [r["id"] for r in items],
+                [item_weight(r) for r in items],
+                [r["user_id"] for r in items],
+            )
+        except Exception as e:
+            print(f"❌ gacha audit error: {e}")
+            await interaction.followup.send("❌ 監査に失敗しました。", ephemeral=True)
+            return
+        elapsed = time.monotonic() - started
+
+        item_stat, item_dof, item_p = gacha_audit.chi_square(result.item_observed, result.item_expected)
+        owner_stat, owner_dof, owner_p = gacha_audit.chi_square(result.owner_observed, result.owner_expected)
+
+        lines = [
+            f"対象：{result.draws}回（{elapsed:.1f}秒）",
+            "期待値は現在の重みと各ユーザーの所持状況から計算（天井による確定枠は区別しない）",
+            "",
+            f"📦 品目別 χ²={item_stat:.1f}（自由度{item_dof}）p={item_p:.4f}",
+            f"🎙 提供者別 χ²={owner_stat:.1f}（自由度{owner_dof}）p={owner_p:.4f}",
+        ]
+
+        item_out = gacha_audit.outliers(result.item_ids, result.item_observed, result.item_expected)
+        owner_out = gacha_audit.outliers(result.owner_list, result.owner_observed, result.owner_expected)
+        if item_out or owner_out:
+            lines.append("")
+            lines.append(f"⚠️ 外れ値（|z|>{gacha_audit.OUTLIER_Z:g}）")
+            for gid, obs, exp, z in item_out:
+                lines.append(f"No.{gid}：{obs}回 / 期待{exp:.1f}回（z={z:+.1f}）")
+            for owner_id, obs, exp, z in owner_out:
+                lines.append(f"<@{owner_id}>：{obs}回 / 期待{exp:.1f}回（z={z:+.1f}）")
+        else:
+            lines.append("外れ値なし。")
+        lines.append("")
+        lines.append("📎 品目別・提供者別の全件は添付の CSV")
+
+        csv_file = discord.File(io.BytesIO(gacha_audit.to_csv(result)), filename="gacha_audit.csv")
+        await interaction.followup.send("\n".join(lines), file=csv_file, ephemeral=True)
+
+    # ------------------------------
+    # 連打ガード
+    # ------------------------------
+    def _try_begin_pull(self, user_id: int) -> bool:
+        now = time.monotonic()
+        if user_id in self._inflight:
+            return False
+        done_at = self._recent.get(user_id)
+        if done_at is not None and now - done_at < GACHA_DEDUPE_WINDOW_SEC:
+            return False
+
+        self._inflight[user_id] = now
+        return True
+
+    def _end_pull(self, user_id: int):
+        now = time.monotonic()
+        self._inflight.pop(user_id, None)
+        self._recent[user_id] = now
+
+        # 古い完了記録を掃除（件数が増えたときだけ）
+        if len(self._recent) > 1000:
+            self._recent = {
+                uid: t for uid, t in self._recent.items()
+                if now - t < GACHA_DEDUPE_WINDOW_SEC
+            }
+
     # ------------------------------
     # ガチャ実行
     # ------------------------------
     async def run_gacha(self, interaction: discord.Interaction, count: int):
         user = interaction.user
-        price = GACHA_PRICE_SINGLE if count == 1 else GACHA_PRICE_TEN
+
+        # DB接続を取る前に重複を弾く
+        if not self._try_begin_pull(user.id):
+            self.duplicate_pulls += 1
+            try:
+                await interaction.response.send_message(
+                    "処理中だ。連打するな。",
+                    ephemeral=True
+                )
+            except discord.InteractionResponded:
+                pass
+            return
+
+        try:
+            await self._run_gacha(interaction, count)
+        finally:
+            self._end_pull(user.id)
+
+    async def _run_gacha(self, interaction: discord.Interaction, count: int):
+        user = interaction.user
+        price = GACHA_PRICES[count]
 
         try:
             async with self.pool.acquire() as conn:
                 async with conn.transaction():
-                    balance = await conn.fetchval(
-                        "SELECT balance FROM wallet WHERE user_id=$1 FOR UPDATE",
+                    wallet = await conn.fetchrow(
+                        "SELECT balance, pity FROM wallet WHERE user_id=$1 FOR UPDATE",
                         user.id
                     )
+                    balance = wallet["balance"] if wallet else None
+
+                    if balance is not None:
+                        # 自分宛ての未反映クレジットも残高に含める
+                        balance = await wallet_ledger.fold_pending(conn, user.id)
 
                     if balance is None or balance < price:
                         await interaction.response.send_message(
@@ -103,61 +688,73 @@ class GachaCog(commands.Cog):
 
                     before_balance = balance
 
-                    owned_ids = {
-                        r["gacha_list_id"]
-                        for r in await conn.fetch(
-                            "SELECT gacha_list_id FROM gacha_log WHERE user_id=$1",
-                            user.id
-                        )
-                    }
-
-                    all_list = await conn.fetch("SELECT * FROM gacha_list")
-                    available = [r for r in all_list if r["id"] not in owned_ids]
+                    owned = await self.owned.get(conn, user.id)
+                    drawn = self.catalog.sample_unowned(
+                        owned, count, wallet["pity"], GACHA_PITY_THRESHOLD
+                    )
 
-                    if count == 10 and len(available) < 10:
+                    if drawn is None and count > 1:
                         await interaction.response.send_message(
-                            "10連するほど残ってない。",
+                            f"{count}連するほど残ってない。",
                             ephemeral=True
                         )
                         return
 
-                    if len(available) < count:
+                    if drawn is None:
                         await interaction.response.send_message(
                             "もう引けるものがない。",
                             ephemeral=True
                         )
                         return
 
-                    results = random.sample(available, count)
+                    results, pity = drawn
 
+                    # 提供者報酬・購入ログ・集計テーブルを1文でまとめて処理
+                    # （提供者報酬は台帳に追記するだけなので提供者の wallet 行は触らない）
                     await conn.execute(
-                        "UPDATE wallet SET balance = balance - $1 WHERE user_id=$2",
-                        price, user.id
-                    )
-
-                    for r in results:
-                        await conn.execute(
-                            "INSERT INTO wallet (user_id, balance) VALUES ($1,0) "
-                            "ON CONFLICT (user_id) DO NOTHING",
-                            r["user_id"]
+                        """
+                        WITH logged AS (
+                            INSERT INTO gacha_log (user_id, gacha_list_id)
+                            SELECT $1, unnest($2::bigint[])
+                        ),
+                        per_owner AS (
+                            SELECT owner_id, COUNT(*) AS n
+                            FROM unnest($3::bigint[]) AS owner_id
+                            GROUP BY owner_id
+                        ),
+                        owned AS (
+                            INSERT INTO gacha_owned_by_owner (buyer_id, owner_id, owned_count)
+                            SELECT $1, owner_id, n FROM per_owner ORDER BY owner_id
+                            ON CONFLICT (buyer_id, owner_id)
+                            DO UPDATE SET owned_count = gacha_owned_by_owner.owned_count + EXCLUDED.owned_count
+                        ),
+                        buyer_total AS (
+                            INSERT INTO gacha_buyer_totals (buyer_id, owned_count)
+                            VALUES ($1, cardinality($2::bigint[]))
+                            ON CONFLICT (buyer_id)
+                            DO UPDATE SET owned_count = gacha_buyer_totals.owned_count + EXCLUDED.owned_count
+                        ),
+                        pity AS (
+                            UPDATE wallet SET pity = $5 WHERE user_id = $1
                         )
+                        INSERT INTO wallet_credit_ledger (user_id, amount, pulls)
+                        SELECT owner_id, n * $4, n FROM per_owner
+                        """,
+                        user.id,
+                        [r["id"] for r in results],
+                        [r["user_id"] for r in results],
+                        PROVIDER_REWARD,
+                        pity
+                    )
 
-                        await conn.execute(
-                            "UPDATE wallet SET balance = balance + $1 WHERE user_id=$2",
-                            PROVIDER_REWARD, r["user_id"]
-                        )
+                    # 購入者の引き落とし（自分のボイメを引いた分の報酬も取り込んだ残高が返る）
+                    after_balance = await wallet_ledger.fold_pending(conn, user.id, debit=price)
 
-                        await conn.execute(
-                            "INSERT INTO gacha_log (user_id, gacha_list_id) VALUES ($1,$2)",
-                            user.id, r["id"]
-                        )
-
-                    after_balance = await conn.fetchval(
-                        "SELECT balance FROM wallet WHERE user_id=$1",
-                        user.id
-                    )
+                    # コミット前に反映しておき、失敗したら下で捨てる
+                    self.catalog.mark_owned(owned, results)
 
         except Exception:
+            self.owned.invalidate(user.id)
             await interaction.response.send_message(
                 "内部エラー。機嫌が悪いらしい。",
                 ephemeral=True
@@ -166,11 +763,7 @@ class GachaCog(commands.Cog):
 
         await interaction.response.send_message("結果はDMだ。", ephemeral=True)
 
-        # ログ送信
-        for r in results:
-            await self.send_log(interaction.guild, user, r)
-
-        # DMは1通
+        # DMは1通（ページ送り）、ログはまとめて送る
         await self.send_result_dm_bulk(
             guild=interaction.guild,
             user=user,
@@ -178,111 +771,95 @@ class GachaCog(commands.Cog):
             before_balance=before_balance,
             after_balance=after_balance
         )
+        await self.send_log_bulk(interaction.guild, user, results)
 
     # ------------------------------
     # 結果DM（まとめ）
     # ------------------------------
     async def send_result_dm_bulk(self, guild, user, results, before_balance, after_balance):
-        embed = discord.Embed(
-            title=f"🎰 ガチャ結果（{len(results)}件）",
-            color=EMBED_COLOR
-        )
-
-        for gacha in results:
-            member = guild.get_member(gacha["user_id"])
-            name = gacha["name"] or "名称不明"
-            url = gacha["url"] or "https://example.com"
-            display = member.display_name if member else "退会済み"
-            mention = member.mention if member else f"<@{gacha['user_id']}>"
-
-            embed.add_field(
-                name=f"🎙 ボイメNo.{gacha['id']}",
-                value=f"[{name}]({url})\nvoiced by {mention}（{display}）",
-                inline=False
-            )
-
-            if member and not embed.author.name:
-                embed.set_author(
-                    name=display,
-                    icon_url=member.display_avatar.url
-                )
-
+        view = GachaResultView(guild, results, before_balance, after_balance)
         await self.safe_dm(
             user,
-            content =  f"残高：{before_balance}G → {after_balance}G",
-            embed=embed
+            content=view.balance_text,
+            embed=view.build_embed(),
+            view=view if view.pages > 1 else None
         )
-        
 
     # ------------------------------
-    # ログ
+    # ログ（1回のガチャにつき、まとめて送る）
     # ------------------------------
-    async def send_log(self, guild, buyer, gacha):
+    async def send_log_bulk(self, guild, buyer, results):
         channel = guild.get_channel(GACHA_LOG_TC_ID)
         if not channel:
             return
 
-        embed = discord.Embed(
-            title="ボイメガチャ購入ログ",
-            color=EMBED_COLOR,
-            description=(
-                f"購入者：{buyer.mention}\n"
-                f"提供者：<@{gacha['user_id']}>\n"
-                f"当選：[{gacha['name']}]({gacha['url']})"
+        header = f"購入者：{buyer.mention}（{len(results)}件）\n"
+        lines = [
+            f"提供者：<@{gacha['user_id']}>｜当選：[{gacha['name']}]({gacha['url']})"
+            for gacha in results
+        ]
+
+        # 説明文の上限に収まるように Embed を分割
+        chunks: list[list[str]] = [[]]
+        size = len(header)
+        for line in lines:
+            if chunks[-1] and size + len(line) + 1 > LOG_EMBED_CHARS:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(line)
+            size += len(line) + 1
+
+        embeds = [
+            discord.Embed(
+                title="ボイメガチャ購入ログ" if i == 0 else None,
+                color=EMBED_COLOR,
+                description=(header if i == 0 else "") + "\n".join(chunk)
             )
-        )
-
-        try:
-            await channel.send(embed=embed)
-        except discord.Forbidden:
-            pass
+            for i, chunk in enumerate(chunks)
+        ]
+
+        # 1メッセージの合計6000文字を超えないように分けて送る。1通失敗しても残りは送る
+        for batch in pack_embeds(embeds):
+            try:
+                await channel.send(embeds=batch)
+            except discord.Forbidden:
+                return
+            except discord.HTTPException as e:
+                print(f"❌ ガチャログ送信失敗: {e}")
 
     # ------------------------------
     # コンプ率
     # ------------------------------
     async def show_completion(self, interaction: discord.Interaction):
         async with self.pool.acquire() as conn:
-            rows = await conn.fetch(
-                """
-                WITH totals AS (
-                    SELECT
-                        user_id AS owner_id,
-                        COUNT(*) AS total_count
-                    FROM gacha_list
-                    GROUP BY user_id
-                ),
-                owned AS (
-                    SELECT
-                        gl.user_id AS owner_id,
-                        COUNT(DISTINCT gl.id) AS owned_count
-                    FROM gacha_log g
-                    JOIN gacha_list gl ON gl.id = g.gacha_list_id
-                    WHERE g.user_id = $1
-                    GROUP BY gl.user_id
-                )
-                SELECT
-                    t.owner_id,
-                    COALESCE(o.owned_count, 0) AS owned_count,
-                    t.total_count
-                FROM totals t
-                LEFT JOIN owned o ON o.owner_id = t.owner_id
-                ORDER BY (COALESCE(o.owned_count, 0)::float / t.total_count) DESC
-                """,
+            owned_rows = await conn.fetch(
+                "SELECT owner_id, owned_count FROM gacha_owned_by_owner WHERE buyer_id = $1",
                 interaction.user.id
             )
-
-        # ===== 3) トータル所持率 =====
-            total_all = await conn.fetchval(
-                "SELECT COUNT(*) FROM gacha_list"
-            )
             owned_all = await conn.fetchval(
-                f"""
-                SELECT COUNT(*)
-                FROM gacha_log 
-                WHERE user_id = $1;
-                """,
+                "SELECT owned_count FROM gacha_buyer_totals WHERE buyer_id = $1",
                 interaction.user.id
-            )
+            ) or 0
+
+        # 提供者ごとの総数はスナップショットから
+        totals = self.catalog.owner_totals()
+        owned_by_owner = {r["owner_id"]: r["owned_count"] for r in owned_rows}
+
+        rows = sorted(
+            (
+                {
+                    "owner_id": owner_id,
+                    "owned_count": owned_by_owner.get(owner_id, 0),
+                    "total_count": total,
+                }
+                for owner_id, total in totals.items()
+            ),
+            key=lambda r: r["owned_count"] / r["total_count"],
+            reverse=True
+        )
+
+        # ===== 3) トータル所持率 =====
+        total_all = len(self.catalog)
 
         lines = []
         
@@ -322,11 +899,10 @@ class GachaCog(commands.Cog):
     async def show_provider_income(self, interaction: discord.Interaction):
         async with self.pool.acquire() as conn:
             count = await conn.fetchval(
-                "SELECT COUNT(*) FROM gacha_log gl "
-                "JOIN gacha_list g ON gl.gacha_list_id = g.id "
-                "WHERE g.user_id=$1",
+                "SELECT pull_count FROM gacha_provider_pulls WHERE provider_id=$1",
                 interaction.user.id
-            )
+            ) or 0
+            count += await wallet_ledger.pending_pulls(conn, interaction.user.id)
 
         await interaction.response.send_message(
             f"あなたのボイメは **{count}回** 引かれた。\n"
@@ -334,6 +910,14 @@ class GachaCog(commands.Cog):
             ephemeral=True
         )
 
+    # ------------------------------
+    # 一覧
+    # ------------------------------
+    async def show_browse(self, interaction: discord.Interaction):
+        view = GachaBrowseView(self, interaction.user.id)
+        embed = await view.render_current()
+        await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+
 # ==============================
 # setup
 # ==============================
@@ -1,46 +1,195 @@
+import asyncio
 import os
+from collections import Counter
+
 import discord
 from discord import app_commands, Embed, Color
 from discord.ext import commands
-from utils.profile_repo import set_profile, set_color, get_profile
+from utils.profile_repo import (
+    ensure_schema, forget_profile_messages, get_profile, get_unresolved_profiles,
+    record_profile_message, set_channel_ids, set_color
+)
 from utils.color import determine_color
+from utils import profile_indexer
+from utils.profile_cache import CachedProfile, ProfileCache
+from utils.vc_embed_store import VCEmbedStore, purge_messages
+from utils.vc_roster import VCRoster
+from utils.voice_embeds import VoiceEmbedTracker
 
 GUILD_ID = int(os.getenv("GUILD_ID"))
 
+# prof.channel_id 埋め：同時に投げる fetch_message の数 / まとめて書き込む件数
+BACKFILL_CONCURRENCY = 4
+BACKFILL_BATCH = 100
+
 class ProfileCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.PROFILE_TC_IDS = [int(x) for x in os.getenv("PROFILE_TC_IDS", "").split(",") if x]
         self.IGNORE_VC_CHANNEL_IDS = [int(x) for x in os.getenv("IGNORE_VC_CHANNEL_IDS", "").split(",") if x]
         self.IGNORE_VC_CATEGORY_IDS = [int(x) for x in os.getenv("IGNORE_VC_CATEGORY_IDS", "").split(",") if x]
-        self.embed_cache = {}
+        # 個別 Embed の代わりに、VC ごとに1枚のロスターメッセージを編集する VC（人数の多いイベント VC など）
+        self.ROSTER_VC_IDS = [int(x) for x in os.getenv("PROFILE_ROSTER_VC_IDS", "").split(",") if x]
+        # (guild_id, member_id) ごとの入室 Embed。出入りをまとめて差分だけ送信・削除し、DB にも記録する
+        self.vc_embed_store = VCEmbedStore(bot.profile_db_pool) if bot.profile_db_pool else None
+        self.voice_embeds = VoiceEmbedTracker(self.send_profile_embed, self.vc_embed_store)
+        self.vc_roster = VCRoster(self.build_profile_embed, self.vc_embed_store)
+        self._reconcile_task: asyncio.Task | None = None
+        # user_id -> プロフィール投稿の中身（入室のたびに DB・REST を引かないため）
+        self.profile_cache = ProfileCache()
+        self._backfill_task: asyncio.Task | None = None
         print("🧪 ProfileCog インスタンス化された")
 
+    async def cog_load(self):
+        if self.bot.profile_db_pool is None:
+            return
+        await ensure_schema(self.bot.profile_db_pool)
+        async with self.bot.profile_db_pool.acquire() as conn:
+            await profile_indexer.ensure_schema(conn)
+        await self.vc_embed_store.ensure_schema()
+        self.bot.add_view(self.vc_roster.view)
+        self._backfill_task = asyncio.create_task(self.backfill_channel_ids())
+        self._reconcile_task = asyncio.create_task(self.reconcile_vc_embeds())
+
+    async def cog_unload(self):
+        self.voice_embeds.cancel()
+        self.vc_roster.cancel()
+        for task in (self._backfill_task, self._reconcile_task):
+            if task:
+                task.cancel()
+
+    def _ignored(self, ch) -> bool:
+        return bool(ch and (ch.id in self.IGNORE_VC_CHANNEL_IDS or (ch.category and ch.category.id in self.IGNORE_VC_CATEGORY_IDS)))
+
+    def _roster(self, ch) -> bool:
+        return bool(ch and ch.id in self.ROSTER_VC_IDS)
+
+    # ------------------------------
+    # 再起動前に出した入室 Embed を実際の VC 状態と突き合わせる（起動時に1回）
+    # ------------------------------
+    async def reconcile_vc_embeds(self):
+        await self.bot.wait_until_ready()
+        rows = await self.vc_embed_store.load()
+
+        # まだ同じ VC にいる人の Embed は残し、それ以外はチャンネルごとにまとめて消す
+        stale: dict[tuple[int, int], list[int]] = {}
+        for r in rows:
+            guild = self.bot.get_guild(r["guild_id"])
+            member = guild.get_member(r["member_id"]) if guild else None
+            voice = member.voice.channel if member and member.voice else None
+            if voice is not None and voice.id == r["channel_id"] and not self._ignored(voice) and not self._roster(voice):
+                self.voice_embeds.restore(member, r["channel_id"], r["message_id"])
+            else:
+                stale.setdefault((r["guild_id"], r["channel_id"]), []).append(r["message_id"])
+
+        # ロスターは VC がまだロスター対象なら同じメッセージを編集し続ける
+        rosters = await self.vc_embed_store.load_rosters()
+        for r in rosters:
+            guild = self.bot.get_guild(r["guild_id"])
+            channel = guild.get_channel(r["channel_id"]) if guild else None
+            if self._roster(channel) and not self._ignored(channel):
+                self.vc_roster.restore(channel, r["message_id"])
+            else:
+                stale.setdefault((r["guild_id"], r["channel_id"]), []).append(r["message_id"])
+
+        purged = 0
+        for (guild_id, channel_id), message_ids in stale.items():
+            guild = self.bot.get_guild(guild_id)
+            channel = guild.get_channel(channel_id) if guild else None
+            if channel is not None:
+                purged += await purge_messages(channel, message_ids)
+        stale_ids = [mid for mids in stale.values() for mid in mids]
+        if stale_ids:
+            await self.vc_embed_store.remove_many(stale_ids)
+
+        # 停止中に入室した人には Embed を出し、ロスターは今のメンバーで描き直す
+        joined = 0
+        for guild in self.bot.guilds:
+            for vc in guild.voice_channels:
+                if self._ignored(vc):
+                    continue
+                if self._roster(vc):
+                    self.vc_roster.touch(vc)
+                    continue
+                for member in vc.members:
+                    if self.voice_embeds.shown(guild.id, member.id) is None:
+                        self.voice_embeds.on_event(member, None, vc, 1)
+                        joined += 1
+
+        print(f"✅ VC Embed 突き合わせ: 継続 {len(rows) + len(rosters) - len(stale_ids)}件・削除 {purged}/{len(stale_ids)}件・新規 {joined}件")
+
+    # ------------------------------
+    # 既存の prof 行に channel_id を埋める（起動時に1回）
+    # ------------------------------
+    async def backfill_channel_ids(self):
+        await self.bot.wait_until_ready()
+        pool = self.bot.profile_db_pool
+        rows = await get_unresolved_profiles(pool)
+        guild = self.bot.get_guild(GUILD_ID)
+        if not rows or guild is None:
+            return
+
+        print(f"🔎 prof.channel_id 埋め開始: {len(rows)}件")
+        channels = [ch for ch in (guild.get_channel(i) for i in self.PROFILE_TC_IDS) if ch]
+        found_in = Counter()
+        sem = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+        done = 0
+
+        async def resolve(row):
+            async with sem:
+                # よく当たるチャンネルから試す
+                for ch in sorted(channels, key=lambda c: -found_in[c.id]):
+                    try:
+                        await ch.fetch_message(row["message_id"])
+                    except discord.NotFound:
+                        continue
+                    except discord.HTTPException as e:
+                        print(f"⚠️ channel_id 埋め失敗（次回再試行）: user_id={row['user_id']} {e}")
+                        return None
+                    found_in[ch.id] += 1
+                    return row["user_id"], row["message_id"], ch.id
+                return row["user_id"], row["message_id"], 0
+
+        for i in range(0, len(rows), BACKFILL_BATCH):
+            results = await asyncio.gather(*(resolve(r) for r in rows[i:i + BACKFILL_BATCH]))
+            resolved = [r for r in results if r is not None]
+            await set_channel_ids(pool, resolved)
+            done += len(resolved)
+            print(f"🔎 prof.channel_id 埋め: {done}/{len(rows)}")
+
+        self.profile_cache.clear()
+        print(f"✅ prof.channel_id 埋め完了: {done}件")
+
     @app_commands.command(name="プロフ登録", description="プロフィールチャンネル内の全ユーザーの投稿を登録します")
+    @app_commands.describe(full="前回の続きからではなく最初から読み直す")
     @app_commands.guilds(discord.Object(id=GUILD_ID))
     @app_commands.default_permissions(administrator=True)
-    async def register_all_profiles(self, interaction: discord.Interaction):
+    async def register_all_profiles(self, interaction: discord.Interaction, full: bool = False):
         if not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message("❌ あなたは管理者ではありません。", ephemeral=True)
             return
 
         await interaction.response.defer(ephemeral=True)  # ← ここで先に応答！
 
-        updated = 0
-        seen_users = set()
+        channels = [ch for ch in (interaction.guild.get_channel(i) for i in self.PROFILE_TC_IDS) if ch]
+        status = await interaction.followup.send("⏳ プロフィールを取り込み中...", ephemeral=True, wait=True)
 
-        for tc_id in self.PROFILE_TC_IDS:
-            channel = interaction.guild.get_channel(tc_id)
-            if not channel:
-                continue
-            async for msg in channel.history(limit=None, oldest_first=True):
-                if msg.author.bot or msg.author.id in seen_users:
-                    continue
-                await set_profile(self.bot.profile_db_pool, msg.author.id, msg.id)
-                seen_users.add(msg.author.id)
-                updated += 1
+        async def on_progress(progress: list[profile_indexer.ChannelProgress]):
+            lines = [
+                f"{'✅' if p.done else '⏳'} #{p.name}：{p.scanned}件読込・{p.upserted}件登録"
+                for p in progress
+            ]
+            try:
+                await status.edit(content="\n".join(lines))
+            except discord.HTTPException:
+                pass
 
+        progress = await profile_indexer.index_channels(
+            self.bot.profile_db_pool, channels, on_progress=on_progress, full=full
+        )
+        self.profile_cache.clear()
 
+        updated = sum(p.upserted for p in progress)
         await interaction.followup.send(f"✅ {updated} 件のプロフィールを登録しました。", ephemeral=True)
 
     @app_commands.command(name="プロフカラー登録", description="プロフィールカラーを登録")
@@ -48,14 +197,71 @@ class ProfileCog(commands.Cog):
     @app_commands.default_permissions(administrator=True)
     async def register_color(self, interaction: discord.Interaction, user: discord.User, color: str):
         await set_color(self.bot.profile_db_pool, user.id, color)
+        self.profile_cache.invalidate_user(user.id)
         await interaction.response.send_message("✅ カラーを更新しました。", ephemeral=True)
 
+    @app_commands.command(name="プロフキャッシュ", description="プロフィールキャッシュと入室 Embed の状況を表示します")
+    @app_commands.guilds(discord.Object(id=GUILD_ID))
+    @app_commands.default_permissions(administrator=True)
+    async def profile_cache_stats(self, interaction: discord.Interaction):
+        cache = self.profile_cache
+        total = cache.hits + cache.misses
+        rate = cache.hits / total * 100 if total else 0.0
+        await interaction.response.send_message(
+            f"🗂️ プロフィールキャッシュ：{len(cache)}件\n"
+            f"ヒット {cache.hits} / ミス {cache.misses}（ヒット率 {rate:.1f}%）\n"
+            f"🎧 入室 Embed：API {self.voice_embeds.rest_calls}回・"
+            f"まとめたイベント {self.voice_embeds.coalesced}件・省いた API {self.voice_embeds.suppressed}回\n"
+            f"📋 ロスター：{len(self.vc_roster.boards)}VC・送信 {self.vc_roster.sends}回・"
+            f"編集 {self.vc_roster.edits}回・削除 {self.vc_roster.deletes}回・まとめた入退室 {self.vc_roster.coalesced}件",
+            ephemeral=True
+        )
+
+    # ------------------------------
+    # プロフィール投稿の索引（投稿者 -> 最新投稿）を投稿・削除・編集に追従させる
+    # ------------------------------
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        if message.channel.id not in self.PROFILE_TC_IDS or message.author.bot:
+            return
+        if self.bot.profile_db_pool is None:
+            return
+
+        row = await record_profile_message(
+            self.bot.profile_db_pool, message.author.id, message.id, message.channel.id
+        )
+        if row is not None:
+            # 最新投稿になったので、そのままキャッシュに載せる（次の入室は DB・REST なし）
+            self.profile_cache.put(message.author.id, CachedProfile(
+                message.id, message.channel.id, message.content, message.jump_url, row["embed_color"]
+            ))
 
     @commands.Cog.listener()
-    async def on_voice_state_update(self, member, before, after):
-        def ignored(ch):
-            return ch and (ch.id in self.IGNORE_VC_CHANNEL_IDS or (ch.category and ch.category.id in self.IGNORE_VC_CATEGORY_IDS))
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        if payload.channel_id in self.PROFILE_TC_IDS:
+            self.profile_cache.invalidate_message(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.channel_id in self.PROFILE_TC_IDS:
+            await self._forget_messages([payload.message_id])
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        if payload.channel_id in self.PROFILE_TC_IDS:
+            await self._forget_messages(list(payload.message_ids))
+
+    async def _forget_messages(self, message_ids: list[int]):
+        for mid in message_ids:
+            self.profile_cache.invalidate_message(mid)
+        if self.bot.profile_db_pool is None:
+            return
+        for user_id in await forget_profile_messages(self.bot.profile_db_pool, message_ids):
+            self.profile_cache.invalidate_user(user_id)
 
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
         if self.bot.profile_db_pool is None:
             print("❗ profile_db_pool is not initialized yet.")
             return
@@ -65,94 +271,100 @@ class ProfileCog(commands.Cog):
 
         print(f"🎧 VCチャンネル変化検出: {member} | before={before.channel} | after={after.channel}")
 
-        # VC入室
-        if not before.channel and after.channel:
-            if ignored(after.channel):
-                return
-
-            key = (member.guild.id, member.id)
-            if key in self.embed_cache:
-                print(f"⚠️ 二重送信防止: {member}")
-                return
-
-            await self.send_profile_embed(member, after.channel)
+        before_ch = None if self._ignored(before.channel) else before.channel
+        after_ch = None if self._ignored(after.channel) else after.channel
+        if before_ch is None and after_ch is None:
             return
 
-
-        # VC移動
-        if before.channel and after.channel and before.channel != after.channel:
-            if ignored(before.channel) and ignored(after.channel):
-                return
-
-            # 前VCのembed削除
-            key = (member.guild.id, member.id)
-            msg_id = self.embed_cache.pop(key, None)
-            if msg_id and not ignored(before.channel):
-                try:
-                    msg = await before.channel.fetch_message(msg_id)
-                    await msg.delete()
-                    print(f"🗑️ Embed削除: message_id={msg_id}")
-                except Exception as e:
-                    print(f"⚠️ Embed削除失敗: {e}")
-
-            if ignored(after.channel):
-                return
-            await self.send_profile_embed(member, after.channel)
+        # ロスター VC は1枚のメッセージを編集する（個別 Embed は出さない）
+        for ch in (before_ch, after_ch):
+            if self._roster(ch):
+                self.vc_roster.touch(ch)
+        before_ch = None if self._roster(before_ch) else before_ch
+        after_ch = None if self._roster(after_ch) else after_ch
+        if before_ch is None and after_ch is None:
             return
 
-        # VC退出
-        if before.channel and not after.channel:
-            if ignored(before.channel):
-                return
-            key = (member.guild.id, member.id)
-            msg_id = self.embed_cache.pop(key, None)
-            if msg_id:
-                try:
-                    msg = await before.channel.fetch_message(msg_id)
-                    await msg.delete()
-                    print(f"🗑️ Embed削除: message_id={msg_id}")
-                except Exception as e:
-                    print(f"⚠️ Embed削除失敗: {e}")
-            return
+        # 即時に処理していたら叩いていた回数（送信1 / 取得+削除2）
+        naive = (1 if after_ch else 0) + (2 if before_ch and self.voice_embeds.shown(member.guild.id, member.id) else 0)
+        self.voice_embeds.on_event(member, before_ch, after_ch, naive)
 
-    async def send_profile_embed(self, member, channel):
+    async def _fetch_in(self, ch, msg_id: int):
+        if ch is None:
+            return None
+        try:
+            return await ch.fetch_message(msg_id)
+        except discord.NotFound:
+            return None
+
+    async def _load_profile(self, member) -> CachedProfile | None:
+        """prof の投稿を1回の fetch で取る。チャンネル履歴は読まない"""
         prof = await get_profile(self.bot.profile_db_pool, member.id)
         if not prof:
-            return
+            return None
 
-        msg_id, col = prof["bio"], prof["color"]
-        msg = None
+        msg_id, col, channel_id = prof["bio"], prof["color"], prof["channel_id"]
 
+        # 0 = どのプロフィールチャンネルにも見つからなかった（当たり直さない）
+        if channel_id == 0:
+            return None
+        if channel_id is not None:
+            ch = member.guild.get_channel(channel_id)
+            try:
+                msg = await self._fetch_in(ch, msg_id)
+            except discord.HTTPException as e:
+                print(f"⚠️ プロフィール取得失敗: {e}")
+                return None
+            if msg:
+                return CachedProfile(msg.id, ch.id, msg.content, msg.jump_url, col)
+            if ch is not None:
+                # 削除イベントを取りこぼしていた：索引から外し、次に新しい投稿があればそれを使う
+                if await forget_profile_messages(self.bot.profile_db_pool, [msg_id]):
+                    return await self._load_profile(member)
+            return None
+
+        # channel_id 未解決の行（埋め処理の前）だけ、ID で各チャンネルを当たる
         for tc_id in self.PROFILE_TC_IDS:
             ch = member.guild.get_channel(tc_id)
-            if ch:
-                try:
-                    msg = await ch.fetch_message(msg_id)
-                except Exception as e:
-                    async for m in ch.history(limit=100):
-                        if m.author.id == member.id and not m.author.bot:
-                            await set_profile(self.bot.profile_db_pool, member.id, m.id)
-                            msg = m
-                            break
-                    if not msg:
-                        continue
+            try:
+                msg = await self._fetch_in(ch, msg_id)
+            except discord.HTTPException as e:
+                print(f"⚠️ プロフィール取得失敗: {e}")
+                continue
+            if msg:
+                await set_channel_ids(self.bot.profile_db_pool, [(member.id, msg.id, ch.id)])
+                return CachedProfile(msg.id, ch.id, msg.content, msg.jump_url, col)
+        return None
+
+    async def build_profile_embed(self, member) -> Embed | None:
+        hit, prof = self.profile_cache.lookup(member.id)
+        if not hit:
+            prof = await self._load_profile(member)
+            self.profile_cache.put(member.id, prof)
+        if prof is None:
+            return None
+
+        embed = Embed(
+            description=f"{prof.content}\n\n[▷リアクションはこちら]({prof.jump_url})\n\n👤 <@{member.id}>",
+            color=determine_color(prof.color, member)
+        )
+        embed.set_author(
+            name=member.display_name,
+            icon_url=member.display_avatar.url
+        )
+        return embed
 
-                link = msg.jump_url
-                embed = Embed(
-                    description=f"{msg.content}\n\n[▷リアクションはこちら]({link})\n\n👤 <@{member.id}>",
-                    color=determine_color(col, member)
-                )
-                embed.set_author(
-                    name=member.display_name,
-                    icon_url=member.display_avatar.url
-                )
-                try:
-                    sent = await channel.send(embed=embed)
-                    print(f"✅ Embed送信完了: message_id={sent.id}")
-                    self.embed_cache[(member.guild.id, member.id)] = sent.id
-                except Exception as e:
-                    print(f"❌ Embed送信失敗: {e}")
-                return  # 一回送信したら抜ける
+    async def send_profile_embed(self, member, channel) -> int | None:
+        embed = await self.build_profile_embed(member)
+        if embed is None:
+            return None
+        try:
+            sent = await channel.send(embed=embed)
+            print(f"✅ Embed送信完了: message_id={sent.id}")
+            return sent.id
+        except Exception as e:
+            print(f"❌ Embed送信失敗: {e}")
+            return None
 
 
 async def setup(bot):
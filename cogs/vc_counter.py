@@ -3,101 +3,268 @@ import discord
 from discord.ext import tasks, commands
 from discord import app_commands
 from dotenv import load_dotenv
-import asyncpg
+
+from datetime import datetime
+
+from utils import stat_channels, stats_counters
+from utils.stat_channels import RenameScheduler
 
 load_dotenv()
 
+# ダッシュボードを更新する間隔（stats_counters はこの間隔で1回だけ読む。値が変わっていなければ編集しない）
+DASHBOARD_INTERVAL_SEC = 30
+
 class VCCounter(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        # チャンネル名の変更はチャンネルごとの枠を見ながらまとめて流す
+        self.renamer = RenameScheduler()
+        # ダッシュボード用：最後に読んだ stats_counters / guild_id -> (channel_id, message_id)
+        self.counters: dict[str, int] = {}
+        self.dashboards: dict[int, tuple[int, int]] = {}
+        self._dashboard_shown: dict[int, tuple] = {}
+
+    async def cog_load(self):
+        # gacha_log のパーティション化（GachaCog）より後に読み込まれること
+        pool = getattr(self.bot, "db", None)
+        if pool is None:
+            return
+        async with pool.acquire() as conn:
+            await stats_counters.ensure_schema(conn)
+            await stat_channels.ensure_schema(conn, int(os.getenv("GUILD_ID")))
+            rows = await conn.fetch("SELECT guild_id, channel_id, message_id FROM stat_dashboards")
+        self.dashboards = {r["guild_id"]: (r["channel_id"], r["message_id"]) for r in rows}
         self.update_vc_names.start()
+        self.refresh_dashboards.start()
 
     def cog_unload(self):
         self.update_vc_names.cancel()
+        self.refresh_dashboards.cancel()
+        self.renamer.cancel()
 
-    async def _update(self, guild: discord.Guild):
-        matching_ch = guild.get_channel(1464186246535315564)
-        gacha_ch = guild.get_channel(1459246559324668057)
-        # blackjack_ch = guild.get_channel(1466648900768239722)
-        # chohan_ch = guild.get_channel(1467317822056304640)
-
-        if matching_ch is None or gacha_ch is None:
-            print("⚠️ channel not found")
-            return
+    async def _read_counters(self) -> bool:
+        try:
+            async with self.bot.db.acquire() as conn:
+                self.counters = await stats_counters.read(conn)
+            return True
+        except Exception as e:
+            print(f"❌ stats_counters read error: {e}")
+            return False
 
-        db = self.bot.db
+    async def _update(self, guild: discord.Guild) -> int:
+        """stat_channels の設定どおりに名前を作り、変更が要るチャンネル数を返す"""
         try:
-            if isinstance(db, asyncpg.Pool):
-                async with db.acquire() as conn:
-                    row = await conn.fetchrow("""
-                        SELECT
-                        (SELECT COUNT(*) FROM matching_choose) AS matching_total,
-                        (SELECT COUNT(*) FROM matching_choose WHERE "check" = 1) AS matching_kotsu,
-                        (SELECT COUNT(*) FROM gacha_log) AS gacha_total
-                    """)
-                    #     (SELECT SUM(amount) FROM blackjack_record) AS blackjack_total,
-                    #     (SELECT SUM(amount) FROM hancho_record) AS chohan_total
-                    # """)
-            else:
-                conn: asyncpg.Connection = db
-                row = await conn.fetchrow("""
-                    SELECT
-                    (SELECT COUNT(*) FROM matching_choose) AS matching_total,
-                    (SELECT COUNT(*) FROM matching_choose WHERE "check" = 1) AS matching_kotsu,
-                    (SELECT COUNT(*) FROM gacha_log) AS gacha_total
-                """)
-                #     (SELECT SUM(amount) FROM blackjack_record) AS blackjack_total,
-                #     (SELECT SUM(amount) FROM hancho_record) AS chohan_total
-                # """)
+            async with self.bot.db.acquire() as conn:
+                names = await stat_channels.render_names(conn, guild.id)
         except Exception as e:
             print(f"❌ DB error: {e}")
-            return
+            return 0
 
-        new_name = f"👩‍❤️‍💋‍👨マッチ：{row['matching_total']}回｜個通数：{row['matching_kotsu']}"
-        gacha_name = f"🎰ガチャ：{row['gacha_total']}回"
-        # blackjack_name = f"🃏ブラックジャック：{row['blackjack_total']}"
-        # chohan_name = f"🎲チョーハン：{row['chohan_total']}"
-
-        try:
-            if matching_ch.name != new_name:
-                await matching_ch.edit(name=new_name)
-            if gacha_ch.name != gacha_name:
-                await gacha_ch.edit(name=gacha_name)
-            # if blackjack_ch.name != blackjack_name:
-            #     await blackjack_ch.edit(name=blackjack_name)
-            # if chohan_ch.name != chohan_name:
-            #     await chohan_ch.edit(name=chohan_name)
-
-            print(f"✅ {guild.name} のVC名を更新しました。")
-        except discord.Forbidden:
-            print("❌ 権限不足でチャンネル名を変更できません")
-        except discord.HTTPException as e:
-            print(f"❌ Discord API error: {e}")
+        changed = 0
+        for channel_id, name in names.items():
+            channel = guild.get_channel(channel_id)
+            if channel is None:
+                print(f"⚠️ channel not found: {channel_id}")
+                continue
+            if channel.name != name:
+                self.renamer.request(channel, name)
+                changed += 1
+        return changed
 
-    @tasks.loop(hours=1)
+    # 件数の取得は軽く、変更は RenameScheduler が枠に合わせて流すので短い間隔で回してよい
+    @tasks.loop(minutes=1)
     async def update_vc_names(self):
-        # 1ギルド運用なら、ここは最初の1個だけ取ればOK
-        if not self.bot.guilds:
-            return
-        await self._update(self.bot.guilds[0])
+        for guild in self.bot.guilds:
+            await self._update(guild)
 
     @update_vc_names.before_loop
     async def before_update(self):
         await self.bot.wait_until_ready()
 
+    # ------------------------------
+    # ダッシュボード（1ギルド1メッセージを定期的に編集）
+    # ------------------------------
+    def _dashboard_values(self, guild: discord.Guild) -> list[tuple[str, str]]:
+        """最後に読んだ値だけで (項目名, 値) を作る（DB・API は叩かない）"""
+        c = self.counters
+        values = [
+            ("👩‍❤️‍💋‍👨 マッチ", f"{c.get('matching_total', 0)}回"),
+            ("📞 個通数", f"{c.get('matching_kotsu', 0)}"),
+            ("🎰 ガチャ", f"{c.get('gacha_total', 0)}回"),
+        ]
+
+        bump = self.bot.get_cog("BumpListener")
+        if bump is not None:
+            for p in bump.providers.values():
+                board = bump.leaderboards.get(p.key)
+                if board is not None:
+                    values.append((f"🚀 {p.label}（{p.service}）", f"{board.total}回"))
+
+        sessions = getattr(self.bot, "active_sessions", {}).get(guild.id, [])
+        values.append(("🚨 救助中のVC", f"{len(sessions)}件"))
+        return values
+
+    def _dashboard_embed(self, values: list[tuple[str, str]]) -> discord.Embed:
+        embed = discord.Embed(
+            title="📊 サーバー統計",
+            color=discord.Color.blurple(),
+            timestamp=datetime.utcnow()
+        )
+        for name, value in values:
+            embed.add_field(name=name, value=value, inline=True)
+        embed.set_footer(text=f"{DASHBOARD_INTERVAL_SEC}秒ごとに更新")
+        return embed
+
+    @tasks.loop(seconds=DASHBOARD_INTERVAL_SEC)
+    async def refresh_dashboards(self):
+        if not self.dashboards or not await self._read_counters():
+            return
+        for guild_id, (channel_id, message_id) in list(self.dashboards.items()):
+            guild = self.bot.get_guild(guild_id)
+            channel = guild.get_channel(channel_id) if guild else None
+            if channel is None:
+                continue
+
+            values = self._dashboard_values(guild)
+            key = tuple(values)
+            if self._dashboard_shown.get(guild_id) == key:
+                continue
+
+            try:
+                await channel.get_partial_message(message_id).edit(embed=self._dashboard_embed(values))
+                self._dashboard_shown[guild_id] = key
+            except discord.NotFound:
+                print(f"⚠️ ダッシュボードが削除されていたので設定を外します: {guild_id}")
+                self.dashboards.pop(guild_id, None)
+                async with self.bot.db.acquire() as conn:
+                    await conn.execute(
+                        "DELETE FROM stat_dashboards WHERE guild_id = $1 AND message_id = $2",
+                        guild_id, message_id
+                    )
+            except discord.HTTPException as e:
+                print(f"❌ Discord API error: {e}")
+
+    @refresh_dashboards.before_loop
+    async def before_refresh_dashboards(self):
+        await self.bot.wait_until_ready()
+
+    @app_commands.guilds(discord.Object(id=int(os.getenv("GUILD_ID"))))
+    @app_commands.command(name="統計ダッシュボード設置", description="このチャンネルに統計ダッシュボードを設置します（管理者限定）")
+    @app_commands.default_permissions(administrator=True)
+    async def setup_dashboard(self, interaction: discord.Interaction):
+        guild = interaction.guild
+        await interaction.response.send_message("✅ 統計ダッシュボードを設置しました。", ephemeral=True)
+        await self._read_counters()
+        values = self._dashboard_values(guild)
+        msg = await interaction.channel.send(embed=self._dashboard_embed(values))
+        try:
+            await msg.pin()
+        except discord.HTTPException as e:
+            print(f"⚠️ ダッシュボードのピン留めに失敗: {e}")
+
+        async with self.bot.db.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO stat_dashboards (guild_id, channel_id, message_id) VALUES ($1, $2, $3)
+                ON CONFLICT (guild_id) DO UPDATE SET channel_id = EXCLUDED.channel_id, message_id = EXCLUDED.message_id
+                """,
+                guild.id, msg.channel.id, msg.id
+            )
+
+        # 古いダッシュボードは片付ける
+        old = self.dashboards.get(guild.id)
+        self.dashboards[guild.id] = (msg.channel.id, msg.id)
+        self._dashboard_shown[guild.id] = tuple(values)
+        if old:
+            old_channel = guild.get_channel(old[0])
+            if old_channel is not None:
+                try:
+                    await old_channel.get_partial_message(old[1]).delete()
+                except discord.HTTPException:
+                    pass
+
     @app_commands.guilds(discord.Object(id=int(os.getenv("GUILD_ID"))))
     @app_commands.command(name="人数更新", description="人数を手動更新します（管理者限定）")
     @app_commands.default_permissions(administrator=True)
     async def update_vc_command(self, interaction: discord.Interaction):
         await interaction.response.defer(thinking=True)
+        changed = await self._update(interaction.guild)
+        if changed == 0:
+            await interaction.followup.send("✅ VCの名前は最新です。")
+            return
+        await interaction.followup.send(
+            f"✅ {changed}件のVC名の更新を予約しました。"
+            f"（変更待ち {self.renamer.pending()}件・まとめた更新 {self.renamer.coalesced}件）"
+        )
+
+    @app_commands.guilds(discord.Object(id=int(os.getenv("GUILD_ID"))))
+    @app_commands.command(name="統計チャンネル設定", description="チャンネル名に出す統計を設定します（管理者限定）")
+    @app_commands.describe(channel="名前を書き換えるチャンネル", template="名前の書式。{matching_total} などが値に置き換わる")
+    @app_commands.default_permissions(administrator=True)
+    async def set_stat_channel(self, interaction: discord.Interaction, channel: discord.abc.GuildChannel, template: str):
+        # 指標の SQL を流すと3秒を超えることがあるので先に応答しておく
+        await interaction.response.defer(ephemeral=True)
+        try:
+            fields = stat_channels.template_fields(template)
+        except ValueError as e:
+            await interaction.followup.send(f"❌ 書式が正しくありません：{e}", ephemeral=True)
+            return
+
+        async with self.bot.db.acquire() as conn:
+            unknown = fields - await stat_channels.known_metrics(conn)
+            if unknown:
+                await interaction.followup.send(
+                    f"❌ 知らない指標です：{', '.join(sorted(unknown))}", ephemeral=True
+                )
+                return
+            await conn.execute(
+                """
+                INSERT INTO stat_channels (channel_id, guild_id, template) VALUES ($1, $2, $3)
+                ON CONFLICT (channel_id) DO UPDATE SET template = EXCLUDED.template
+                """,
+                channel.id, interaction.guild.id, template
+            )
+        await interaction.followup.send(f"✅ {channel.mention} を統計チャンネルに設定しました。", ephemeral=True)
         await self._update(interaction.guild)
-        await interaction.followup.send("✅ VCの名前を更新しました。")
+
+    @app_commands.guilds(discord.Object(id=int(os.getenv("GUILD_ID"))))
+    @app_commands.command(name="統計チャンネル解除", description="統計チャンネルの設定を外します（管理者限定）")
+    @app_commands.default_permissions(administrator=True)
+    async def remove_stat_channel(self, interaction: discord.Interaction, channel: discord.abc.GuildChannel):
+        async with self.bot.db.acquire() as conn:
+            deleted = await conn.fetchval(
+                "DELETE FROM stat_channels WHERE channel_id = $1 AND guild_id = $2 RETURNING channel_id",
+                channel.id, interaction.guild.id
+            )
+        if deleted is None:
+            await interaction.response.send_message("⚠️ そのチャンネルは統計チャンネルではありません。", ephemeral=True)
+            return
+        await interaction.response.send_message(f"✅ {channel.mention} の統計チャンネル設定を外しました。", ephemeral=True)
 
     @update_vc_command.error
     async def update_vc_command_error(self, interaction: discord.Interaction, error):
         if isinstance(error, app_commands.errors.MissingPermissions):
             await interaction.followup.send("❌ このコマンドは管理者のみ使用できます。", ephemeral=True)
 
+    @app_commands.guilds(discord.Object(id=int(os.getenv("GUILD_ID"))))
+    @app_commands.command(name="人数再集計", description="統計カウンタを元テーブルから数え直します（管理者限定）")
+    @app_commands.default_permissions(administrator=True)
+    async def rebuild_counters_command(self, interaction: discord.Interaction):
+        await interaction.response.defer(thinking=True)
+        try:
+            async with self.bot.db.acquire() as conn:
+                counts = await stats_counters.rebuild(conn)
+        except Exception as e:
+            print(f"❌ stats_counters rebuild error: {e}")
+            await interaction.followup.send("❌ 数え直しに失敗しました。")
+            return
+
+        await self._update(interaction.guild)
+        await interaction.followup.send(
+            "✅ 統計カウンタを数え直しました。\n"
+            f"マッチ：{counts['matching_total']}回｜個通数：{counts['matching_kotsu']}｜ガチャ：{counts['gacha_total']}回"
+        )
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(VCCounter(bot))
 
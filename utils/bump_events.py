@@ -0,0 +1,139 @@
+import asyncio
+from datetime import datetime, timezone
+
+import asyncpg
+
+# BUMP / UP の成功を1件ずつ bump_events に追記し、同じトランザクションで
+# 日・週・月の集計（bump_rollup）へ加算する。
+# 期間ランキングは bump_rollup の1バケットだけを読むので、イベントが何年分溜まっても速さは変わらない。
+
+# 集計の区切りはサーバーの生活時間（JST）
+BUMP_TZ = "Asia/Tokyo"
+PERIODS = ("day", "week", "month")
+
+EVENTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bump_events (
+    id BIGSERIAL PRIMARY KEY,
+    provider TEXT NOT NULL,
+    user_id BIGINT NOT NULL,
+    channel_id BIGINT,
+    message_id BIGINT,
+    occurred_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS bump_events_occurred_brin ON bump_events USING BRIN (occurred_at);
+
+CREATE TABLE IF NOT EXISTS bump_rollup (
+    provider TEXT NOT NULL,
+    period TEXT NOT NULL,
+    bucket DATE NOT NULL,
+    user_id BIGINT NOT NULL,
+    amount INTEGER NOT NULL,
+    PRIMARY KEY (provider, period, bucket, user_id)
+);
+CREATE INDEX IF NOT EXISTS bump_rollup_rank_idx
+    ON bump_rollup (provider, period, bucket, amount DESC, user_id);
+"""
+
+# 書き込みバッファをまとめて流す間隔 / 件数
+FLUSH_INTERVAL_SEC = 5
+FLUSH_MAX_EVENTS = 500
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    await conn.execute(EVENTS_SCHEMA)
+
+
+def _bucket_sql(period: str, ts: str) -> str:
+    return f"date_trunc('{period}', {ts} AT TIME ZONE '{BUMP_TZ}')::date"
+
+
+class BumpEventBuffer:
+    """
+    成功イベントをメモリに溜め、flush() でまとめて1文で書き込む（write-behind）。
+    失敗したバッチは先頭に戻して次回に再送する。
+    """
+
+    def __init__(self, pool: asyncpg.Pool):
+        self.pool = pool
+        self._pending: list[tuple[str, int, int | None, int | None, datetime]] = []
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def append(self, provider: str, user_id: int, channel_id: int | None, message_id: int | None):
+        self._pending.append((provider, user_id, channel_id, message_id, datetime.now(timezone.utc)))
+
+    async def flush(self) -> int:
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            providers, users, channels, messages, times = map(list, zip(*batch))
+
+            rollups = "\nUNION ALL\n".join(
+                f"SELECT provider, '{p}' AS period, {_bucket_sql(p, 'occurred_at')} AS bucket, user_id FROM ins"
+                for p in PERIODS
+            )
+            try:
+                async with self.pool.acquire() as conn:
+                    await conn.execute(
+                        f"""
+                        WITH ins AS (
+                            INSERT INTO bump_events (provider, user_id, channel_id, message_id, occurred_at)
+                            SELECT * FROM unnest($1::text[], $2::bigint[], $3::bigint[], $4::bigint[], $5::timestamptz[])
+                            RETURNING provider, user_id, occurred_at
+                        )
+                        INSERT INTO bump_rollup (provider, period, bucket, user_id, amount)
+                        SELECT provider, period, bucket, user_id, COUNT(*)
+                        FROM ({rollups}) r
+                        GROUP BY provider, period, bucket, user_id
+                        ON CONFLICT (provider, period, bucket, user_id)
+                        DO UPDATE SET amount = bump_rollup.amount + EXCLUDED.amount
+                        """,
+                        providers, users, channels, messages, times
+                    )
+            except BaseException:
+                self._pending[:0] = batch
+                raise
+            return len(batch)
+
+
+async def period_page(
+    pool: asyncpg.Pool, provider: str, period: str, offset: int, limit: int
+) -> tuple[list[tuple[int, int]], int]:
+    """今の period バケットの (user_id, amount) を amount 降順で1ページ分と、対象人数"""
+    bucket = _bucket_sql(period, "now()")
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            f"""
+            SELECT user_id, amount FROM bump_rollup
+            WHERE provider = $1 AND period = $2 AND bucket = {bucket}
+            ORDER BY amount DESC, user_id
+            OFFSET $3 LIMIT $4
+            """,
+            provider, period, offset, limit
+        )
+        total = await conn.fetchval(
+            f"SELECT COUNT(*) FROM bump_rollup WHERE provider = $1 AND period = $2 AND bucket = {bucket}",
+            provider, period
+        )
+    return [(r["user_id"], r["amount"]) for r in rows], total
+
+
+async def period_rank(pool: asyncpg.Pool, provider: str, period: str, user_id: int) -> tuple[int, int] | None:
+    """今の period バケットでの (順位, amount)。順位は RANK() と同じ"""
+    bucket = _bucket_sql(period, "now()")
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(
+            f"""
+            SELECT me.amount, (
+                SELECT COUNT(*) FROM bump_rollup o
+                WHERE o.provider = $1 AND o.period = $2 AND o.bucket = {bucket} AND o.amount > me.amount
+            ) + 1 AS rank
+            FROM bump_rollup me
+            WHERE me.provider = $1 AND me.period = $2 AND me.bucket = {bucket} AND me.user_id = $3
+            """,
+            provider, period, user_id
+        )
+    return (row["rank"], row["amount"]) if row else None
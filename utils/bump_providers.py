@@ -0,0 +1,113 @@
+import json
+import os
+import re
+from dataclasses import dataclass, field
+
+# BUMP 系サービスの定義。bot_id で引けるので、対象外の発言は dict 1回で弾ける。
+# 追加のサービスは環境変数 BUMP_PROVIDERS_JSON（下の項目名の dict のリスト）で足せる。
+# 例:
+#   [{"key": "dicoall", "bot_id": 903541413298450462, "label": "UP", "service": "Dicoall",
+#     "table": "dicoall_amount", "success": ["アップしました"], "command": "/up"}]
+
+
+@dataclass
+class BumpProvider:
+    key: str
+    bot_id: int
+    label: str            # "BUMP" / "UP"
+    service: str          # 表示名
+    table: str            # 累計回数テーブル (user_id, amount)
+    success: list[str]    # 成功文言（正規表現）
+    ng: list[str] = field(default_factory=list)  # 1つでも含めば失敗扱い（正規表現）
+    cooldown: int = 60 * 60 * 2
+    command: str = "/bump"                        # 成功 Embed に出すコマンド名
+    reminder_command: str | None = None           # リマインドに出す表記（省略時は `command`）
+    footer: str | None = None
+    watch_edits: bool = False                     # 編集で後から embed が付くサービス
+
+    def __post_init__(self):
+        # 成功・NG を1本の正規表現にまとめ、embed テキストを1回なめるだけで判定する
+        alts = [f"(?P<ng>{'|'.join(f'(?:{p})' for p in self.ng)})"] if self.ng else []
+        alts.append(f"(?P<ok>{'|'.join(f'(?:{p})' for p in self.success)})")
+        self._matcher = re.compile("|".join(alts))
+        if self.reminder_command is None:
+            self.reminder_command = f"`{self.command}`"
+        if self.footer is None:
+            self.footer = f"{self.service} {self.label.capitalize()} Tracker"
+
+    def matches(self, text: str) -> bool:
+        if not self.ng:
+            return self._matcher.search(text) is not None
+        ok = False
+        for m in self._matcher.finditer(text):
+            if m.lastgroup == "ng":
+                return False
+            ok = True
+        return ok
+
+
+DEFAULT_PROVIDERS = [
+    BumpProvider(
+        key="disboard",
+        bot_id=302050872383242240,
+        label="BUMP",
+        service="DISBOARD",
+        table="bump_amount",
+        success=[re.escape("表示順をアップしたよ")],
+        command="/bump",
+        reminder_command="</bump:947088344167366698>",
+    ),
+    BumpProvider(
+        key="dissoku",
+        bot_id=761562078095867916,  # ディス速Bot
+        label="UP",
+        service="ディス速",
+        table="up_amount",
+        success=[r"をアップしたよ[!！]"],  # 半角/全角 ! 対応
+        ng=["失敗", "間隔をあけてください", "間隔を開けてください"],
+        command="/up",
+        watch_edits=True,
+    ),
+]
+
+_TABLE_RE = re.compile(r"[a-z_][a-z0-9_]*")
+
+
+def load_providers() -> dict[int, BumpProvider]:
+    """bot_id -> BumpProvider。環境変数の定義は同じ key の既定値を上書きする"""
+    providers = {p.key: p for p in DEFAULT_PROVIDERS}
+    raw = os.getenv("BUMP_PROVIDERS_JSON")
+    if raw:
+        for conf in json.loads(raw):
+            p = BumpProvider(**conf)
+            if not _TABLE_RE.fullmatch(p.table):
+                raise ValueError(f"不正なテーブル名: {p.table}")
+            providers[p.key] = p
+    return {p.bot_id: p for p in providers.values()}
+
+
+def embed_text(embed) -> str:
+    """embed 内テキスト（title + description + fields）"""
+    parts: list[str] = []
+    if embed.title:
+        parts.append(embed.title)
+    if embed.description:
+        parts.append(embed.description)
+
+    for f in getattr(embed, "fields", []) or []:
+        if f.name:
+            parts.append(str(f.name))
+        if f.value:
+            parts.append(str(f.value))
+
+    return "\n".join(parts)
+
+
+def detect(providers: dict[int, BumpProvider], author_id: int, embeds, edited: bool = False) -> BumpProvider | None:
+    """成功メッセージなら該当サービスを返す"""
+    provider = providers.get(author_id)
+    if provider is None or not embeds:
+        return None
+    if edited and not provider.watch_edits:
+        return None
+    return provider if provider.matches(embed_text(embeds[0])) else None
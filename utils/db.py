@@ -22,10 +22,14 @@ class DB:
     @classmethod
     async def get_profile_message_link(cls, user: 'discord.Member'):
         async with cls.pool.acquire() as conn:
-            row = await conn.fetchrow("SELECT message_id FROM prof WHERE user_id = $1", int(user.id))
+            row = await conn.fetchrow("SELECT message_id, channel_id FROM prof WHERE user_id = $1", int(user.id))
             if not row:
                 return None
 
+            guild_id = os.getenv("GUILD_ID")
+            if row["channel_id"]:
+                return f"https://discord.com/channels/{guild_id}/{row['channel_id']}/{row['message_id']}"
+
             role_ids = [r.id for r in user.roles]
 
             if any(int(os.getenv(k)) in role_ids for k in ["ROLE_NONPLAYER1_ID", "ROLE_NONPLAYER2_ID", "ROLE_NONPLAYER3_ID"]):
@@ -37,7 +41,6 @@ class DB:
             else:
                 return None
 
-            guild_id = os.getenv("GUILD_ID")
             return f"https://discord.com/channels/{guild_id}/{channel_id}/{row['message_id']}"
         
     @classmethod
@@ -0,0 +1,22 @@
+import discord
+
+# 1メッセージに載せられる Embed の数・合計文字数の上限（超えると送信ごと 400 になる）
+MESSAGE_EMBEDS = 10
+MESSAGE_EMBED_CHARS = 6000
+
+
+def pack_embeds(embeds: list[discord.Embed]) -> list[list[discord.Embed]]:
+    """1メッセージの上限（10件・合計6000文字）に収まるように分ける"""
+    pages: list[list[discord.Embed]] = []
+    current: list[discord.Embed] = []
+    size = 0
+    for embed in embeds:
+        n = len(embed)
+        if current and (len(current) >= MESSAGE_EMBEDS or size + n > MESSAGE_EMBED_CHARS):
+            pages.append(current)
+            current, size = [], 0
+        current.append(embed)
+        size += n
+    if current:
+        pages.append(current)
+    return pages
@@ -0,0 +1,214 @@
+import asyncio
+import csv
+import io
+import math
+from dataclasses import dataclass
+
+import asyncpg
+import numpy as np
+
+# COPY ... (FORMAT binary) の1行：列数(int16) + [長さ(int32) + bigint] × 2
+_ROW_DTYPE = np.dtype([
+    ("nfields", ">i2"),
+    ("len_user", ">i4"), ("user_id", ">i8"),
+    ("len_item", ">i4"), ("item_id", ">i8"),
+])
+_HEADER_LEN = 19  # "PGCOPY\n\377\r\n\0" + flags(int32) + 拡張長(int32)
+
+# 1回の集計で処理する行数の目安
+CHUNK_ROWS = 500_000
+
+# |z| がこれを超えた品目・提供者を外れ値として報告
+OUTLIER_Z = 4.0
+
+
+@dataclass
+class AuditResult:
+    draws: int
+    item_ids: np.ndarray
+    owner_ids: np.ndarray
+    item_observed: np.ndarray
+    item_expected: np.ndarray
+    owner_list: np.ndarray
+    owner_observed: np.ndarray
+    owner_expected: np.ndarray
+
+
+def chi_square(observed: np.ndarray, expected: np.ndarray) -> tuple[float, int, float]:
+    """(統計量, 自由度, p値)。p値は Wilson–Hilferty 近似"""
+    mask = expected > 0
+    stat = float(np.sum((observed[mask] - expected[mask]) ** 2 / expected[mask]))
+    dof = int(mask.sum()) - 1
+    if dof <= 0:
+        return stat, dof, 1.0
+    z = ((stat / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return stat, dof, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def outliers(ids: np.ndarray, observed: np.ndarray, expected: np.ndarray, limit: int = 5):
+    """|z| > OUTLIER_Z の (id, 実測, 期待, z) を |z| 降順で返す"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(expected > 0, (observed - expected) / np.sqrt(expected), 0.0)
+    idx = np.flatnonzero(np.abs(z) > OUTLIER_Z)
+    idx = idx[np.argsort(-np.abs(z[idx]))][:limit]
+    return [(int(ids[i]), int(observed[i]), float(expected[i]), float(z[i])) for i in idx]
+
+
+def to_csv(result: AuditResult) -> bytes:
+    """品目別・提供者別の実測 / 期待回数の全表（kind, id, owner_id, observed, expected, z）"""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["kind", "id", "owner_id", "observed", "expected", "z"])
+
+    def z_of(obs, exp):
+        return f"{(obs - exp) / math.sqrt(exp):.3f}" if exp > 0 else ""
+
+    for gid, owner_id, obs, exp in zip(result.item_ids, result.owner_ids, result.item_observed, result.item_expected):
+        writer.writerow(["item", int(gid), int(owner_id), int(obs), f"{exp:.3f}", z_of(obs, exp)])
+    for owner_id, obs, exp in zip(result.owner_list, result.owner_observed, result.owner_expected):
+        writer.writerow(["owner", int(owner_id), int(owner_id), int(obs), f"{exp:.3f}", z_of(obs, exp)])
+    # Excel で文字化けしないよう BOM 付き
+    return out.getvalue().encode("utf-8-sig")
+
+
+class _Accumulator:
+    """
+    ユーザー順・ログ順に並んだ抽選を受け取り、品目ごとの期待回数を積み上げる。
+
+    1回の抽選 d で未所持の品目 i が選ばれる確率は w_i / (W - 所持済み重み_d)。
+    inv_d = 1 / (W - 所持済み重み_d) とすると、品目 i の期待回数は
+        w_i × (Σ_d inv_d − Σ_{i を引いた抽選 k} Σ_{同ユーザーの k より後の d} inv_d)
+    なので、ユーザー内の累積和と bincount だけで求まる。
+    """
+
+    def __init__(self, catalog_ids: np.ndarray, weights: np.ndarray):
+        self.catalog_ids = catalog_ids
+        self.weights = weights
+        self.total_weight = float(weights.sum())
+        self.observed = np.zeros(len(catalog_ids), dtype=np.int64)
+        self.tail = np.zeros(len(catalog_ids), dtype=np.float64)
+        self.inv_total = 0.0
+        self.draws = 0
+
+    def add(self, users: np.ndarray, items: np.ndarray):
+        """users / items はユーザー単位で完結していること（途中で切れたユーザーを含まない）"""
+        if len(users) == 0:
+            return
+
+        idx = np.searchsorted(self.catalog_ids, items)
+        idx = np.clip(idx, 0, len(self.catalog_ids) - 1)
+        known = self.catalog_ids[idx] == items
+        users, idx = users[known], idx[known]
+        if len(users) == 0:
+            return
+
+        starts = np.empty(len(users), dtype=bool)
+        starts[0] = True
+        np.not_equal(users[1:], users[:-1], out=starts[1:])
+        group = np.cumsum(starts) - 1
+        start_idx = np.flatnonzero(starts)
+        end_idx = np.append(start_idx[1:], len(users)) - 1
+
+        w = self.weights[idx]
+        cw = np.cumsum(w)
+        owned_before = (cw - w) - (cw - w)[start_idx][group]
+
+        inv = 1.0 / np.maximum(self.total_weight - owned_before, 1e-12)
+        ci = np.cumsum(inv)
+        prefix = ci - (ci - inv)[start_idx][group]
+        tail = prefix[end_idx][group] - prefix
+
+        self.inv_total += float(inv.sum())
+        self.tail += np.bincount(idx, weights=tail, minlength=len(self.catalog_ids))
+        self.observed += np.bincount(idx, minlength=len(self.catalog_ids))
+        self.draws += len(users)
+
+    def expected(self) -> np.ndarray:
+        return self.weights * (self.inv_total - self.tail)
+
+
+async def run_audit(pool: asyncpg.Pool, catalog_ids, weights, owner_ids) -> AuditResult:
+    """
+    gacha_log（集約済み分は1件として）をユーザー順に COPY (binary) で流し込み、チャンクごとに NumPy で集計する。
+    catalog_ids / weights / owner_ids は現在のカタログ（id 昇順）。
+    """
+    order = np.argsort(np.asarray(catalog_ids, dtype=np.int64))
+    catalog_ids = np.asarray(catalog_ids, dtype=np.int64)[order]
+    weights = np.asarray(weights, dtype=np.float64)[order]
+    owner_ids = np.asarray(owner_ids, dtype=np.int64)[order]
+
+    acc = _Accumulator(catalog_ids, weights)
+    buf = bytearray()
+    header_skipped = False
+    carry_users = np.empty(0, dtype=np.int64)
+    carry_items = np.empty(0, dtype=np.int64)
+
+    def consume(rows: np.ndarray, final: bool):
+        nonlocal carry_users, carry_items
+        users = np.concatenate([carry_users, rows["user_id"].astype(np.int64)])
+        items = np.concatenate([carry_items, rows["item_id"].astype(np.int64)])
+        if not final and len(users):
+            # 最後のユーザーは次のチャンクに続くかもしれないので持ち越す
+            cut = np.searchsorted(users, users[-1])
+            carry_users, carry_items = users[cut:], items[cut:]
+            users, items = users[:cut], items[:cut]
+        else:
+            carry_users = carry_items = np.empty(0, dtype=np.int64)
+        acc.add(users, items)
+
+    async def on_data(data: bytes):
+        nonlocal buf, header_skipped
+        buf += data
+        if not header_skipped:
+            if len(buf) < _HEADER_LEN:
+                return
+            ext_len = int.from_bytes(buf[15:19], "big")
+            if len(buf) < _HEADER_LEN + ext_len:
+                return
+            del buf[:_HEADER_LEN + ext_len]
+            header_skipped = True
+
+        n = len(buf) // _ROW_DTYPE.itemsize
+        if n < CHUNK_ROWS:
+            return
+        rows = np.frombuffer(bytes(buf[:n * _ROW_DTYPE.itemsize]), dtype=_ROW_DTYPE)
+        del buf[:n * _ROW_DTYPE.itemsize]
+        await asyncio.to_thread(consume, rows, False)
+
+    async with pool.acquire() as conn:
+        await conn.copy_from_query(
+            """
+            SELECT user_id::bigint, gacha_list_id::bigint
+            FROM (
+                SELECT user_id, gacha_list_id, id FROM gacha_log
+                UNION ALL
+                SELECT user_id, gacha_list_id, first_id FROM gacha_log_archive
+            ) t
+            -- 固定長で読むので NULL（長さ -1・値なし）が1つでもあると以降の行がずれる
+            WHERE user_id IS NOT NULL AND gacha_list_id IS NOT NULL
+            ORDER BY user_id, id
+            """,
+            output=on_data,
+            format="binary",
+        )
+
+    # 末尾の -1（トレーラ）を除いて残りを処理
+    n = len(buf) // _ROW_DTYPE.itemsize
+    rows = np.frombuffer(bytes(buf[:n * _ROW_DTYPE.itemsize]), dtype=_ROW_DTYPE)
+    await asyncio.to_thread(consume, rows, True)
+
+    item_expected = acc.expected()
+    owner_list, owner_idx = np.unique(owner_ids, return_inverse=True)
+    owner_observed = np.bincount(owner_idx, weights=acc.observed, minlength=len(owner_list))
+    owner_expected = np.bincount(owner_idx, weights=item_expected, minlength=len(owner_list))
+
+    return AuditResult(
+        draws=acc.draws,
+        item_ids=catalog_ids,
+        owner_ids=owner_ids,
+        item_observed=acc.observed.astype(np.float64),
+        item_expected=item_expected,
+        owner_list=owner_list,
+        owner_observed=owner_observed,
+        owner_expected=owner_expected,
+    )
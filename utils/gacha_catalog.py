@@ -0,0 +1,392 @@
+import asyncio
+import json
+from collections import OrderedDict
+
+import asyncpg
+
+from utils.gacha_sampling import AliasTable, count_unowned, draw_excluding, reject_rate_high
+
+NOTIFY_CHANNEL = "gacha_list_changed"
+# LISTEN 接続の張り直しに失敗したときの待ち（倍々で伸ばす）
+RESTART_BACKOFF_SEC = 1.0
+RESTART_BACKOFF_MAX_SEC = 60.0
+
+# レアリティ: rarity -> (表示名, 既定の重み)。gacha_list.weight が NULL の行はこの重みを使う
+RARITY_TIERS = {
+    1: ("N", 70.0),
+    2: ("R", 25.0),
+    3: ("SR", 5.0),
+}
+TOP_RARITY = max(RARITY_TIERS)
+
+
+def item_weight(row) -> float:
+    weight = row["weight"]
+    if weight is None or weight <= 0:
+        weight = RARITY_TIERS.get(row["rarity"], RARITY_TIERS[1])[1]
+    return float(weight)
+
+
+def rarity_name(row) -> str:
+    return RARITY_TIERS.get(row["rarity"], RARITY_TIERS[1])[0]
+
+
+class GachaCatalog:
+    """gacha_list の読み取り専用スナップショット（id別 / 提供者別）"""
+
+    def __init__(self, pool: asyncpg.Pool):
+        self.pool = pool
+        self.items: dict[int, asyncpg.Record] = {}
+        self.by_owner: dict[int, set[int]] = {}
+        # 変更のたびに進める。抽選表はこれを見て遅延で作り直す
+        self.version = 0
+        self._tables_version = -1
+        self._table: AliasTable | None = None
+        self._tier_tables: dict[int, AliasTable] = {}
+        self._top_ids: set[int] = set()
+        self._listen_conn: asyncpg.Connection | None = None
+        # 通知で届いた再読込待ちの id。1本のタスクがまとめて1文で読む
+        self._pending_ids: set[int] = set()
+        self._refresh_task: asyncio.Task | None = None
+        self._stopped = False
+        # 全件読込の間に通知された id -> 削除か（読込結果で上書きされるので、後で当て直す）
+        self._touched: dict[int, bool] | None = None
+
+    # ------------------------------
+    # 参照
+    # ------------------------------
+    def get(self, gacha_id: int):
+        return self.items.get(gacha_id)
+
+    def owner_totals(self) -> dict[int, int]:
+        return {owner_id: len(ids) for owner_id, ids in self.by_owner.items()}
+
+    def __len__(self):
+        return len(self.items)
+
+    # ------------------------------
+    # 抽選
+    # ------------------------------
+    def _ensure_tables(self):
+        if self._tables_version == self.version:
+            return
+
+        ids = list(self.items)
+        self._table = AliasTable(ids, [item_weight(self.items[gid]) for gid in ids])
+
+        by_tier: dict[int, list[int]] = {}
+        for gid in ids:
+            by_tier.setdefault(self.items[gid]["rarity"], []).append(gid)
+        self._tier_tables = {
+            tier: AliasTable(tier_ids, [item_weight(self.items[gid]) for gid in tier_ids])
+            for tier, tier_ids in by_tier.items()
+        }
+        self._top_ids = set(by_tier.get(TOP_RARITY, ()))
+        self._tables_version = self.version
+
+    def _user_table(self, entry: "OwnedEntry") -> AliasTable:
+        """
+        ユーザー用の抽選表。普段は全体表を使い、所持済みに偏って棄却が増えたら
+        未所持だけの表をユーザーごとに作って使い回す。
+        """
+        table = entry.table if entry.table_version == self.version else self._table
+        if table and reject_rate_high(table, entry.ids):
+            ids = [gid for gid in self.items if gid not in entry.ids]
+            table = AliasTable(ids, [item_weight(self.items[gid]) for gid in ids])
+            entry.table = table
+            entry.table_version = self.version
+        return table
+
+    def _top_unowned(self, entry: "OwnedEntry") -> int:
+        """
+        ユーザーの最上位レアリティの未所持数。抽選表を作り直したときだけ数え直し、
+        あとは mark_owned で減らす（引くたびに所持を走査しない）
+        """
+        if entry.top_version != self._tables_version:
+            top = self._top_ids
+            entry.top_unowned = len(top) - sum(1 for gid in entry.ids if gid in top)
+            entry.top_table = None
+            entry.top_version = self._tables_version
+        return entry.top_unowned
+
+    def _user_top_table(self, entry: "OwnedEntry") -> AliasTable | None:
+        """天井用の表。_user_table と同じく、所持済みに偏ったら未所持だけの表をユーザーごとに作る"""
+        table = entry.top_table or self._tier_tables.get(TOP_RARITY)
+        if table and reject_rate_high(table, entry.ids):
+            ids = [gid for gid in self._top_ids if gid not in entry.ids]
+            table = AliasTable(ids, [item_weight(self.items[gid]) for gid in ids])
+            entry.top_table = table
+        return table
+
+    def mark_owned(self, entry: "OwnedEntry", rows):
+        """コミットした結果を所持済みに反映する"""
+        for r in rows:
+            if r["id"] in entry.ids:
+                continue
+            entry.ids.add(r["id"])
+            if entry.top_version == self._tables_version and r["id"] in self._top_ids:
+                entry.top_unowned -= 1
+
+    def sample_unowned(self, entry: "OwnedEntry", count: int, pity: int, pity_threshold: int):
+        """
+        未所持から count 件を重み付きで引く。足りなければ None。
+        戻り値は (結果, 新しい天井カウント)。
+        天井に達した回は最上位レアリティの未所持から引く（残っていれば）。
+        最上位を引き切った人は天井の抽選をせず、カウントは天井の手前で止める。
+        """
+        owned = entry.ids
+        remaining = len(self.items) - len(owned)
+        if remaining < count:
+            remaining = count_unowned(self.items, owned)
+        if remaining < count:
+            return None
+
+        self._ensure_tables()
+        table = self._user_table(entry)
+        top_left = self._top_unowned(entry)
+
+        picked: list[asyncpg.Record] = []
+        seen: set[int] = set()
+        for _ in range(count):
+            gid = None
+            if pity + 1 >= pity_threshold and top_left > 0:
+                gid = draw_excluding(self._user_top_table(entry), owned, seen)
+            if gid is None:
+                gid = draw_excluding(table, owned, seen)
+
+            seen.add(gid)
+            item = self.items[gid]
+            picked.append(item)
+            if item["rarity"] == TOP_RARITY:
+                pity = 0
+                top_left -= 1
+            else:
+                pity = min(pity + 1, pity_threshold - 1)
+
+        return picked, pity
+
+    # ------------------------------
+    # 更新
+    # ------------------------------
+    def _put(self, row: asyncpg.Record):
+        self._remove(row["id"])
+        self.items[row["id"]] = row
+        self.version += 1
+        self.by_owner.setdefault(row["user_id"], set()).add(row["id"])
+
+    def _remove(self, gacha_id: int):
+        old = self.items.pop(gacha_id, None)
+        if old is None:
+            return
+        self.version += 1
+        ids = self.by_owner.get(old["user_id"])
+        if ids is not None:
+            ids.discard(gacha_id)
+            if not ids:
+                del self.by_owner[old["user_id"]]
+
+    async def reload(self):
+        touched = self._touched = {}
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch("SELECT * FROM gacha_list")
+        finally:
+            self._touched = None
+
+        # 別に組み立ててから差し替える（読込中の通知で変えた分を巻き戻さない）
+        items: dict[int, asyncpg.Record] = {}
+        by_owner: dict[int, set[int]] = {}
+        for r in rows:
+            items[r["id"]] = r
+            by_owner.setdefault(r["user_id"], set()).add(r["id"])
+        self.items, self.by_owner = items, by_owner
+        self.version += 1
+
+        # 読込中に通知された行は読込結果より新しいかもしれないので、削除は当て直して全部読み直す
+        for gacha_id, deleted in touched.items():
+            if deleted:
+                self._remove(gacha_id)
+        if touched:
+            self._pending_ids.update(touched)
+            if self._refresh_task is None:
+                self._refresh_task = asyncio.create_task(self._refresh_pending())
+        print(f"✅ gacha_list スナップショット読込: {len(self.items)}件")
+
+    async def _refresh_pending(self):
+        """溜まった id をまとめて読み直す。一括登録でも接続は1本しか使わない"""
+        try:
+            while self._pending_ids:
+                ids, self._pending_ids = self._pending_ids, set()
+                try:
+                    async with self.pool.acquire() as conn:
+                        rows = await conn.fetch("SELECT * FROM gacha_list WHERE id = ANY($1::bigint[])", list(ids))
+                except Exception as e:
+                    print(f"⚠️ gacha_list 再読込失敗（再試行します）: {e}")
+                    self._pending_ids |= ids
+                    await asyncio.sleep(RESTART_BACKOFF_SEC)
+                    continue
+
+                found = set()
+                for row in rows:
+                    self._put(row)
+                    found.add(row["id"])
+                for gacha_id in ids - found:
+                    self._remove(gacha_id)
+        finally:
+            self._refresh_task = None
+
+    # ------------------------------
+    # LISTEN / NOTIFY
+    # ------------------------------
+    async def start(self):
+        self._stopped = False
+        # 全件読込の間に通知された id -> 削除か（読込結果で上書きされるので、後で当て直す）
+        self._touched: dict[int, bool] | None = None
+        await self._connect()
+
+    async def _connect(self):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                f"""
+                CREATE OR REPLACE FUNCTION notify_gacha_list_changed() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'DELETE' THEN
+                        PERFORM pg_notify('{NOTIFY_CHANNEL}', json_build_object('op', TG_OP, 'id', OLD.id)::text);
+                        RETURN OLD;
+                    END IF;
+                    PERFORM pg_notify('{NOTIFY_CHANNEL}', json_build_object('op', TG_OP, 'id', NEW.id)::text);
+                    IF TG_OP = 'UPDATE' AND OLD.id <> NEW.id THEN
+                        PERFORM pg_notify('{NOTIFY_CHANNEL}', json_build_object('op', 'DELETE', 'id', OLD.id)::text);
+                    END IF;
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                DROP TRIGGER IF EXISTS gacha_list_notify ON gacha_list;
+                CREATE TRIGGER gacha_list_notify
+                AFTER INSERT OR UPDATE OR DELETE ON gacha_list
+                FOR EACH ROW EXECUTE FUNCTION notify_gacha_list_changed();
+                """
+            )
+
+        # 通知の取りこぼしを防ぐため、LISTEN を張ってから全件読込
+        self._listen_conn = await self.pool.acquire()
+        await self._listen_conn.add_listener(NOTIFY_CHANNEL, self._on_notify)
+        self._listen_conn.add_termination_listener(self._on_terminate)
+        await self.reload()
+
+    async def stop(self):
+        self._stopped = True
+        if self._refresh_task:
+            self._refresh_task.cancel()
+        await self._release_listen_conn()
+
+    async def _release_listen_conn(self):
+        conn, self._listen_conn = self._listen_conn, None
+        if conn is None:
+            return
+        # プールに返した後でプールが閉じても、切断扱いで張り直さないように外しておく
+        conn.remove_termination_listener(self._on_terminate)
+        try:
+            await conn.remove_listener(NOTIFY_CHANNEL, self._on_notify)
+        except Exception:
+            pass
+        try:
+            await self.pool.release(conn)
+        except Exception:
+            pass
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+
+        deleted = data.get("op") == "DELETE"
+        if deleted:
+            # すぐ抽選対象から外す。読込中の古い行で戻されないよう、読み直しにも回す
+            self._remove(data["id"])
+        if self._touched is not None:
+            self._touched[data["id"]] = deleted or self._touched.get(data["id"], False)
+
+        self._pending_ids.add(data["id"])
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_pending())
+
+    def _on_terminate(self, conn):
+        # LISTEN 接続が切れたら張り直して全件読込し直す
+        if self._stopped:
+            return
+        print("⚠️ gacha_list LISTEN 接続が切断されました。再接続します。")
+        self._listen_conn = None
+        asyncio.create_task(self._restart(conn))
+
+    async def _restart(self, conn):
+        try:
+            await self.pool.release(conn)
+        except Exception:
+            pass
+
+        # DB が戻るまで待ちながら張り直す（諦めるとスナップショットが古いままになる）
+        delay = RESTART_BACKOFF_SEC
+        while not self._stopped:
+            try:
+                await self._connect()
+                print("✅ gacha_list LISTEN 再接続完了")
+                return
+            except Exception as e:
+                print(f"⚠️ gacha_list 再接続失敗（{delay:.0f}秒後に再試行）: {e}")
+                await self._release_listen_conn()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RESTART_BACKOFF_MAX_SEC)
+
+
+class OwnedEntry:
+    """ユーザーの所持済み id と、必要になったときだけ作る未所持用の抽選表"""
+
+    def __init__(self, ids: set[int]):
+        self.ids = ids
+        self.table: AliasTable | None = None
+        self.table_version = -1
+        # 最上位レアリティの未所持数と天井用の表（抽選表の版ごと）
+        self.top_unowned = 0
+        self.top_table: AliasTable | None = None
+        self.top_version = -1
+
+
+class OwnedCache:
+    """ユーザーごとの所持済み gacha_list_id 集合（LRU）"""
+
+    def __init__(self, max_users: int = 1000):
+        self.max_users = max_users
+        self._owned: OrderedDict[int, OwnedEntry] = OrderedDict()
+
+    async def get(self, conn: asyncpg.Connection, user_id: int) -> OwnedEntry:
+        entry = self._owned.get(user_id)
+        if entry is not None:
+            self._owned.move_to_end(user_id)
+            return entry
+
+        entry = OwnedEntry({
+            r["gacha_list_id"]
+            for r in await conn.fetch(
+                "SELECT gacha_list_id FROM gacha_log WHERE user_id=$1 "
+                "UNION ALL "
+                "SELECT gacha_list_id FROM gacha_log_archive WHERE user_id=$1",
+                user_id
+            )
+        })
+        self._owned[user_id] = entry
+        if len(self._owned) > self.max_users:
+            self._owned.popitem(last=False)
+        return entry
+
+    def peek(self, user_id: int) -> OwnedEntry | None:
+        """メモリにあれば返す（DB は見ない）"""
+        entry = self._owned.get(user_id)
+        if entry is not None:
+            self._owned.move_to_end(user_id)
+        return entry
+
+    def invalidate(self, user_id: int):
+        self._owned.pop(user_id, None)
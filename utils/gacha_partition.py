@@ -0,0 +1,205 @@
+import re
+
+import asyncpg
+
+# gacha_log は drawn_at で月ごとにレンジパーティション化する。
+# 保持期間を過ぎたパーティションは集約テーブルへ畳んでから DETACH し、
+# gacha_log_archived_* として切り離す（読み手はもう参照しない）。
+#
+#   gacha_log_archive : (user_id, gacha_list_id) ごとの回数。所持判定・監査用
+#   gacha_log_monthly : 月ごとの総回数。総数カウント用
+
+# 直近この月数ぶんは gacha_log に残す
+RETAIN_MONTHS = 6
+# 先に作っておく未来の月数
+PREMAKE_MONTHS = 2
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS gacha_log_archive (
+    user_id BIGINT NOT NULL,
+    gacha_list_id BIGINT NOT NULL,
+    draws INTEGER NOT NULL,
+    first_id BIGINT,
+    first_drawn_at TIMESTAMPTZ,
+    PRIMARY KEY (user_id, gacha_list_id)
+);
+CREATE TABLE IF NOT EXISTS gacha_log_monthly (
+    month DATE PRIMARY KEY,
+    draws BIGINT NOT NULL
+);
+"""
+
+# 現役 + 集約済みを合わせた「全期間のログ」。所持判定や再集計はこれを読む
+ALL_DRAWS_SQL = """
+SELECT user_id, gacha_list_id, 1 AS draws, id AS first_id FROM gacha_log
+UNION ALL
+SELECT user_id, gacha_list_id, draws, first_id FROM gacha_log_archive
+"""
+
+_UPPER_RE = re.compile(r"TO \('([^']+)'\)")
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    """集約テーブルを作り、gacha_log が未パーティションなら移行する"""
+    await conn.execute(ROLLUP_SCHEMA)
+
+    partitioned = await conn.fetchval("SELECT relkind = 'p' FROM pg_class WHERE oid = 'gacha_log'::regclass")
+    if partitioned:
+        await ensure_partitions(conn)
+        return
+
+    async with conn.transaction():
+        await conn.execute("LOCK TABLE gacha_log IN ACCESS EXCLUSIVE MODE")
+
+        # 既存行は時刻不明なので固定値、新規行は now()
+        await conn.execute(
+            """
+            ALTER TABLE gacha_log
+                ADD COLUMN IF NOT EXISTS drawn_at TIMESTAMPTZ NOT NULL DEFAULT '2000-01-01 00:00:00+00'
+            """
+        )
+        upper = await conn.fetchval(
+            "SELECT date_trunc('month', GREATEST(COALESCE(MAX(drawn_at), now()), now())) "
+            "+ INTERVAL '1 month' FROM gacha_log"
+        )
+
+        await conn.execute("ALTER TABLE gacha_log RENAME TO gacha_log_legacy")
+        await conn.execute(
+            """
+            CREATE TABLE gacha_log (LIKE gacha_log_legacy INCLUDING DEFAULTS)
+            PARTITION BY RANGE (drawn_at);
+            ALTER TABLE gacha_log ALTER COLUMN drawn_at SET DEFAULT now();
+            """
+        )
+
+        # id の採番を新しい親テーブルへ引き継ぐ
+        identity = await conn.fetchval(
+            """
+            SELECT attidentity <> '' FROM pg_attribute
+            WHERE attrelid = 'gacha_log_legacy'::regclass AND attname = 'id'
+            """
+        )
+        if identity:
+            await conn.execute(
+                """
+                CREATE SEQUENCE IF NOT EXISTS gacha_log_id_seq_p;
+                SELECT setval('gacha_log_id_seq_p', COALESCE((SELECT MAX(id) FROM gacha_log_legacy), 0) + 1, false);
+                ALTER TABLE gacha_log ALTER COLUMN id SET DEFAULT nextval('gacha_log_id_seq_p');
+                ALTER SEQUENCE gacha_log_id_seq_p OWNED BY gacha_log.id;
+                ALTER TABLE gacha_log_legacy ALTER COLUMN id DROP IDENTITY;
+                """
+            )
+        elif identity is not None:
+            seq = await conn.fetchval("SELECT pg_get_serial_sequence('gacha_log_legacy', 'id')")
+            if seq:
+                await conn.execute(f"ALTER SEQUENCE {seq} OWNED BY gacha_log.id")
+
+        # LIKE では外部キーが付かないので親に付け直す（旧テーブルの同じ制約は ATTACH 時にそのまま使われる）
+        fkeys = await conn.fetch(
+            """
+            SELECT conname, pg_get_constraintdef(oid) AS def FROM pg_constraint
+            WHERE conrelid = 'gacha_log_legacy'::regclass AND contype = 'f' AND convalidated
+            """
+        )
+        for fk in fkeys:
+            await conn.execute(f'ALTER TABLE gacha_log ADD CONSTRAINT "{fk["conname"]}_p" {fk["def"]}')
+
+        # 旧テーブルはそのまま「〜upper」のパーティションにする（CHECK を先に付けて全件検査を避ける）
+        await conn.execute(
+            f"""
+            ALTER TABLE gacha_log_legacy
+                ADD CONSTRAINT gacha_log_legacy_range CHECK (drawn_at < '{upper.isoformat()}');
+            ALTER TABLE gacha_log ATTACH PARTITION gacha_log_legacy
+                FOR VALUES FROM (MINVALUE) TO ('{upper.isoformat()}');
+            CREATE INDEX IF NOT EXISTS gacha_log_p_user_item_idx ON gacha_log (user_id, gacha_list_id);
+            CREATE INDEX IF NOT EXISTS gacha_log_p_item_idx ON gacha_log (gacha_list_id);
+            """
+        )
+        await ensure_partitions(conn)
+        print(f"✅ gacha_log をパーティション化しました（既存分は {upper:%Y-%m} まで）")
+
+
+async def ensure_partitions(conn: asyncpg.Connection):
+    """今月〜PREMAKE_MONTHS 先までの月パーティションを用意する"""
+    months = await conn.fetch(
+        """
+        SELECT m::date AS lo, (m + INTERVAL '1 month')::date AS hi
+        FROM generate_series(
+            date_trunc('month', now()),
+            date_trunc('month', now()) + make_interval(months => $1),
+            INTERVAL '1 month'
+        ) AS m
+        """,
+        PREMAKE_MONTHS
+    )
+    covered_until = max(
+        (p["hi"].date() for p in await _partitions(conn) if p["hi"] is not None),
+        default=None
+    )
+
+    for r in months:
+        if covered_until is not None and r["lo"] < covered_until:
+            continue
+        name = f"gacha_log_p{r['lo']:%Y%m}"
+        await conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF gacha_log "
+            f"FOR VALUES FROM ('{r['lo']}') TO ('{r['hi']}')"
+        )
+
+
+async def _partitions(conn: asyncpg.Connection):
+    rows = await conn.fetch(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'gacha_log'::regclass
+        """
+    )
+    result = []
+    for r in rows:
+        m = _UPPER_RE.search(r["bound"] or "")
+        hi = await conn.fetchval("SELECT $1::text::timestamptz", m.group(1)) if m else None
+        result.append({"name": r["relname"], "hi": hi})
+    return result
+
+
+async def archive_old(pool: asyncpg.Pool) -> list[str]:
+    """保持期間より古いパーティションを集約して切り離す。切り離したテーブル名を返す"""
+    archived: list[str] = []
+    async with pool.acquire() as conn:
+        cutoff = await conn.fetchval(
+            "SELECT date_trunc('month', now()) - make_interval(months => $1)",
+            RETAIN_MONTHS
+        )
+        for part in await _partitions(conn):
+            if part["hi"] is None or part["hi"] > cutoff:
+                continue
+
+            name = part["name"]
+            async with conn.transaction():
+                await conn.execute(
+                    f"""
+                    INSERT INTO gacha_log_archive (user_id, gacha_list_id, draws, first_id, first_drawn_at)
+                    SELECT user_id, gacha_list_id, COUNT(*), MIN(id), MIN(drawn_at)
+                    FROM {name}
+                    GROUP BY user_id, gacha_list_id
+                    ON CONFLICT (user_id, gacha_list_id) DO UPDATE SET
+                        draws = gacha_log_archive.draws + EXCLUDED.draws,
+                        first_id = LEAST(gacha_log_archive.first_id, EXCLUDED.first_id),
+                        first_drawn_at = LEAST(gacha_log_archive.first_drawn_at, EXCLUDED.first_drawn_at);
+
+                    INSERT INTO gacha_log_monthly (month, draws)
+                    SELECT date_trunc('month', drawn_at)::date, COUNT(*)
+                    FROM {name}
+                    GROUP BY 1
+                    ON CONFLICT (month) DO UPDATE SET draws = gacha_log_monthly.draws + EXCLUDED.draws;
+
+                    ALTER TABLE gacha_log DETACH PARTITION {name};
+                    ALTER TABLE {name} RENAME TO {name.replace('gacha_log_', 'gacha_log_archived_', 1)};
+                    """
+                )
+            archived.append(name)
+            print(f"📦 gacha_log パーティションを集約して切り離しました: {name}")
+    return archived
+
@@ -0,0 +1,71 @@
+import random
+
+# 棄却サンプリングの試行上限（1件あたり）。超えたら絞り込んだ表に切り替える
+MAX_REJECT_TRIES = 64
+
+
+def count_unowned(members, owned: set[int]) -> int:
+    """カタログ（members）のうち owned に含まれない件数"""
+    return len(members) - sum(1 for gid in owned if gid in members)
+
+
+class AliasTable:
+    """Vose のエイリアス法による重み付き抽選表。構築 O(n)、1回の抽選 O(1)"""
+
+    def __init__(self, ids: list[int], weights: list[float]):
+        n = len(ids)
+        self.ids = list(ids)
+        self.weights = list(weights)
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        if n == 0:
+            return
+
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def draw(self, rng=random) -> int:
+        i = rng.randrange(len(self.ids))
+        return self.ids[i] if rng.random() < self.prob[i] else self.ids[self.alias[i]]
+
+
+def draw_excluding(table: AliasTable | None, owned: set[int], seen: set[int], rng=random) -> int | None:
+    """
+    table から owned / seen 以外を1件引く。残りが無ければ None。
+
+    棄却サンプリングで引けなければ、表の中身を絞り込んで重み付きで選ぶ。
+    条件付き分布は元の重みの比率のまま。
+    """
+    if not table:
+        return None
+
+    for _ in range(MAX_REJECT_TRIES):
+        gid = table.draw(rng)
+        if gid not in owned and gid not in seen:
+            return gid
+
+    rest = [
+        (gid, w) for gid, w in zip(table.ids, table.weights)
+        if gid not in owned and gid not in seen
+    ]
+    if not rest:
+        return None
+    return rng.choices([gid for gid, _ in rest], weights=[w for _, w in rest])[0]
+
+
+def reject_rate_high(table: AliasTable, owned: set[int], rng=random, probes: int = 16) -> bool:
+    """表からの棄却が多すぎるか（所持済みに偏っているか）を軽く見積もる"""
+    hits = sum(1 for _ in range(probes) if table.draw(rng) in owned)
+    return hits > probes * 3 // 4
@@ -0,0 +1,53 @@
+from bisect import bisect_left, insort
+
+import asyncpg
+
+
+class Leaderboard:
+    """
+    (user_id, amount) のカウンタテーブルをメモリ上で amount 降順に保持する。
+    順位・ページ取得は二分探索で、DB には起動時の1回しか行かない。
+    """
+
+    def __init__(self, table: str):
+        self.table = table
+        self._amounts: dict[int, int] = {}
+        # (-amount, user_id) の昇順 = amount 降順
+        self._keys: list[tuple[int, int]] = []
+        self.total = 0
+
+    async def load(self, pool: asyncpg.Pool):
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(f"SELECT user_id, amount FROM {self.table}")
+
+        self._amounts = {r["user_id"]: r["amount"] for r in rows}
+        self._keys = sorted((-amount, user_id) for user_id, amount in self._amounts.items())
+        self.total = sum(self._amounts.values())
+        print(f"✅ {self.table} ランキング読込: {len(self._keys)}人")
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, user_id: int, amount: int):
+        """RETURNING amount の値をそのまま反映する"""
+        old = self._amounts.get(user_id)
+        if old == amount:
+            return
+        if old is not None:
+            i = bisect_left(self._keys, (-old, user_id))
+            if i < len(self._keys) and self._keys[i] == (-old, user_id):
+                del self._keys[i]
+        self._amounts[user_id] = amount
+        self.total += amount - (old or 0)
+        insort(self._keys, (-amount, user_id))
+
+    def page(self, offset: int, limit: int) -> list[tuple[int, int]]:
+        """amount 降順で offset から limit 件の (user_id, amount)"""
+        return [(user_id, -neg) for neg, user_id in self._keys[offset:offset + limit]]
+
+    def rank_of(self, user_id: int) -> tuple[int, int] | None:
+        """(順位, amount)。順位は RANK() と同じく「自分より多い人数 + 1」"""
+        amount = self._amounts.get(user_id)
+        if amount is None:
+            return None
+        return bisect_left(self._keys, (-amount, float("-inf"))) + 1, amount
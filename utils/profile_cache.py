@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass
+class CachedProfile:
+    """VC 入室 Embed に必要なプロフィール投稿の中身"""
+    message_id: int
+    channel_id: int
+    content: str
+    jump_url: str
+    color: str | None  # prof.embed_color（ロールによる色はメンバーごとに決める）
+
+
+class ProfileCache:
+    """
+    user_id -> CachedProfile の LRU + TTL キャッシュ。
+    プロフィール未登録（None）も短い TTL で覚えておき、同じ人の入室で毎回 DB を引かない。
+    """
+
+    def __init__(self, max_entries: int = 2000, ttl: float = 30 * 60, negative_ttl: float = 5 * 60,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._entries: OrderedDict[int, tuple[float, CachedProfile | None]] = OrderedDict()
+        self._by_message: dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, user_id: int) -> tuple[bool, CachedProfile | None]:
+        """(キャッシュにあったか, 中身)"""
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > self._clock():
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return True, entry[1]
+        if entry is not None:
+            self.invalidate_user(user_id)
+        self.misses += 1
+        return False, None
+
+    def put(self, user_id: int, profile: CachedProfile | None):
+        self.invalidate_user(user_id)
+        ttl = self.ttl if profile is not None else self.negative_ttl
+        self._entries[user_id] = (self._clock() + ttl, profile)
+        if profile is not None:
+            self._by_message[profile.message_id] = user_id
+        while len(self._entries) > self.max_entries:
+            self.invalidate_user(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None and entry[1] is not None:
+            self._by_message.pop(entry[1].message_id, None)
+
+    def invalidate_message(self, message_id: int) -> bool:
+        user_id = self._by_message.pop(message_id, None)
+        if user_id is None:
+            return False
+        self._entries.pop(user_id, None)
+        return True
+
+    def clear(self):
+        self._entries.clear()
+        self._by_message.clear()
@@ -0,0 +1,162 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+import asyncpg
+import discord
+
+# プロフィールチャンネルの投稿を prof に取り込む。
+#   - チャンネルごとに最後に取り込んだメッセージ ID を prof_index_checkpoint に保存し、次回はその続きから読む
+#   - 取り込みはチャンネル単位のバッファから1文でまとめて書き、同じトランザクションでチェックポイントを進める
+#   - 同じ人の投稿が複数あれば新しいもの（メッセージ ID が大きいもの）を採用する
+#   - 投稿はすべて prof_messages にも残し、最新の投稿が消されたときに次の投稿へ差し替えられるようにする
+#     （以降は ProfileCog の on_message / on_raw_message_delete が追従する）
+
+CHECKPOINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prof_index_checkpoint (
+    channel_id BIGINT PRIMARY KEY,
+    last_message_id BIGINT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS prof_messages (
+    message_id BIGINT PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    channel_id BIGINT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS prof_messages_user_idx ON prof_messages (user_id, message_id DESC);
+"""
+
+# 同時に読むチャンネル数（history はチャンネルごとのレート制限なので並べても詰まらない）
+CHANNEL_CONCURRENCY = 3
+# これだけ読んだら書き込んでチェックポイントを進める
+FLUSH_MESSAGES = 1000
+
+
+@dataclass
+class ChannelProgress:
+    channel_id: int
+    name: str
+    scanned: int = 0
+    upserted: int = 0
+    done: bool = False
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    async with conn.transaction():
+        fresh_messages = await conn.fetchval("SELECT to_regclass('prof_messages') IS NULL")
+        await conn.execute(CHECKPOINT_SCHEMA)
+        if fresh_messages:
+            # prof_messages が無かった頃のチェックポイントでは続きから読めないので捨て、
+            # 分かっている最新投稿だけ先に入れておく
+            await conn.execute(
+                """
+                DELETE FROM prof_index_checkpoint;
+                INSERT INTO prof_messages (message_id, user_id, channel_id)
+                SELECT message_id, user_id, channel_id FROM prof WHERE channel_id > 0
+                ON CONFLICT (message_id) DO NOTHING;
+                """
+            )
+
+
+async def _flush(pool: asyncpg.Pool, channel_id: int, posts: list[tuple[int, int]], last_message_id: int) -> int:
+    """posts は (user_id, message_id) の古い順。prof に実際に登録・更新した行数を返す"""
+    latest = {user_id: message_id for user_id, message_id in posts}
+    upserted = 0
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if posts:
+                await conn.execute(
+                    """
+                    INSERT INTO prof_messages (message_id, user_id, channel_id)
+                    SELECT m, u, $3 FROM unnest($1::bigint[], $2::bigint[]) AS t(u, m)
+                    ON CONFLICT (message_id) DO NOTHING
+                    """,
+                    [u for u, _ in posts], [m for _, m in posts], channel_id
+                )
+                # 既により新しい投稿がある人は WHERE で弾かれ、RETURNING に出ない
+                upserted = await conn.fetchval(
+                    """
+                    WITH up AS (
+                        INSERT INTO prof (user_id, message_id, channel_id)
+                        SELECT u, m, $3 FROM unnest($1::bigint[], $2::bigint[]) AS t(u, m)
+                        ON CONFLICT (user_id) DO UPDATE
+                            SET message_id = EXCLUDED.message_id, channel_id = EXCLUDED.channel_id
+                            WHERE prof.message_id IS NULL OR prof.message_id < EXCLUDED.message_id
+                        RETURNING 1
+                    )
+                    SELECT COUNT(*) FROM up
+                    """,
+                    list(latest.keys()), list(latest.values()), channel_id
+                )
+            await conn.execute(
+                """
+                INSERT INTO prof_index_checkpoint (channel_id, last_message_id) VALUES ($1, $2)
+                ON CONFLICT (channel_id) DO UPDATE SET last_message_id = EXCLUDED.last_message_id, updated_at = now()
+                """,
+                channel_id, last_message_id
+            )
+    return upserted
+
+
+async def index_channel(pool: asyncpg.Pool, channel: discord.TextChannel, progress: ChannelProgress, full: bool = False):
+    async with pool.acquire() as conn:
+        last_id = None if full else await conn.fetchval(
+            "SELECT last_message_id FROM prof_index_checkpoint WHERE channel_id = $1", channel.id
+        )
+
+    after = discord.Object(id=last_id) if last_id else None
+    posts: list[tuple[int, int]] = []
+    scanned_since_flush = 0
+    cursor = last_id
+
+    async for msg in channel.history(limit=None, after=after, oldest_first=True):
+        progress.scanned += 1
+        scanned_since_flush += 1
+        cursor = msg.id
+        if not msg.author.bot:
+            posts.append((msg.author.id, msg.id))
+
+        if scanned_since_flush >= FLUSH_MESSAGES:
+            progress.upserted += await _flush(pool, channel.id, posts, cursor)
+            posts.clear()
+            scanned_since_flush = 0
+
+    if cursor is not None and scanned_since_flush:
+        progress.upserted += await _flush(pool, channel.id, posts, cursor)
+    progress.done = True
+
+
+async def index_channels(
+    pool: asyncpg.Pool,
+    channels: list[discord.TextChannel],
+    on_progress=None,
+    full: bool = False,
+    report_every: float = 5.0,
+) -> list[ChannelProgress]:
+    """
+    channels を並行して取り込む。on_progress(list[ChannelProgress]) を report_every 秒ごとと最後に呼ぶ。
+    途中で止まっても、次回は各チャンネルのチェックポイントの続きから読む。
+    """
+    progress = [ChannelProgress(ch.id, ch.name) for ch in channels]
+    sem = asyncio.Semaphore(CHANNEL_CONCURRENCY)
+
+    async def run(ch, p):
+        async with sem:
+            await index_channel(pool, ch, p, full=full)
+
+    async def report():
+        while True:
+            await asyncio.sleep(report_every)
+            await on_progress(progress)
+
+    reporter = asyncio.create_task(report()) if on_progress else None
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(run(ch, p) for ch, p in zip(channels, progress)))
+    finally:
+        if reporter:
+            reporter.cancel()
+    print(f"✅ プロフィール取り込み完了: {sum(p.scanned for p in progress)}件を {time.perf_counter() - started:.1f}秒")
+    if on_progress:
+        await on_progress(progress)
+    return progress
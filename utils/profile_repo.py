@@ -1,10 +1,7 @@
-async def set_profile(pool, user_id: int, message_id: int):
+async def ensure_schema(pool):
     async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO prof (user_id, message_id)
-            VALUES ($1, $2)
-            ON CONFLICT (user_id) DO UPDATE SET message_id = $2
-        """, user_id, message_id)
+        # 投稿のあるチャンネル。NULL = 未解決、0 = どのプロフィールチャンネルにも見つからなかった
+        await conn.execute("ALTER TABLE prof ADD COLUMN IF NOT EXISTS channel_id BIGINT")
 
 async def set_color(pool, user_id: int, color: str):
     async with pool.acquire() as conn:
@@ -15,7 +12,65 @@ async def set_color(pool, user_id: int, color: str):
 async def get_profile(pool, user_id: int):
     async with pool.acquire() as conn:
         row = await conn.fetchrow("""
-            SELECT message_id AS bio, embed_color AS color FROM prof WHERE user_id = $1
+            SELECT message_id AS bio, embed_color AS color, channel_id FROM prof WHERE user_id = $1
         """, user_id)
         return row
 
+async def record_profile_message(pool, user_id: int, message_id: int, channel_id: int):
+    """
+    新しいプロフィール投稿を記録し、その人の最新投稿なら prof を差し替える。
+    差し替えたときは (embed_color,) の行、古い投稿だったときは None を返す。
+    """
+    async with pool.acquire() as conn:
+        return await conn.fetchrow("""
+            WITH m AS (
+                INSERT INTO prof_messages (message_id, user_id, channel_id) VALUES ($2, $1, $3)
+                ON CONFLICT (message_id) DO NOTHING
+            )
+            INSERT INTO prof (user_id, message_id, channel_id)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (user_id) DO UPDATE SET message_id = EXCLUDED.message_id, channel_id = EXCLUDED.channel_id
+                WHERE prof.message_id IS NULL OR prof.message_id < EXCLUDED.message_id
+            RETURNING embed_color
+        """, user_id, message_id, channel_id)
+
+async def forget_profile_messages(pool, message_ids: list[int]) -> list[int]:
+    """
+    消えた投稿を索引から外し、それが最新投稿だった人は次に新しい投稿へ差し替える。
+    prof を差し替えた user_id を返す（残りの投稿が無い人は prof をそのまま残す）。
+    """
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            WITH gone AS (
+                DELETE FROM prof_messages WHERE message_id = ANY($1::bigint[])
+                RETURNING user_id
+            ),
+            next AS (
+                SELECT DISTINCT ON (pm.user_id) pm.user_id, pm.message_id, pm.channel_id
+                FROM prof_messages pm
+                WHERE pm.user_id IN (SELECT user_id FROM gone)
+                  AND pm.message_id <> ALL($1::bigint[])  -- 同じ文の DELETE はここからは見えない
+                ORDER BY pm.user_id, pm.message_id DESC
+            )
+            UPDATE prof p SET message_id = n.message_id, channel_id = n.channel_id
+            FROM next n
+            WHERE p.user_id = n.user_id AND p.message_id = ANY($1::bigint[])
+            RETURNING p.user_id
+        """, message_ids)
+        return [r["user_id"] for r in rows]
+
+async def get_unresolved_profiles(pool):
+    async with pool.acquire() as conn:
+        return await conn.fetch("SELECT user_id, message_id FROM prof WHERE channel_id IS NULL")
+
+async def set_channel_ids(pool, rows: list[tuple[int, int, int]]):
+    """(user_id, message_id, channel_id)。その間に投稿が差し替わった行は触らない"""
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.executemany("""
+                UPDATE prof SET channel_id = $3 WHERE user_id = $1 AND message_id = $2
+            """, rows)
+            await conn.executemany("""
+                INSERT INTO prof_messages (message_id, user_id, channel_id) VALUES ($2, $1, $3)
+                ON CONFLICT (message_id) DO NOTHING
+            """, [r for r in rows if r[2]])
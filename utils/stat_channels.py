@@ -0,0 +1,197 @@
+import asyncio
+import string
+import time
+from collections import deque
+
+import asyncpg
+import discord
+
+from utils import stats_counters
+
+# 統計チャンネル（チャンネル名に数値を出すやつ）の設定。
+#
+#   stat_channels : channel_id -> (guild_id, template)
+#                   template は str.format 形式で、{指標名} が値に置き換わる
+#   stat_metrics  : 指標名 -> 1値を返す SQL（stats_counters にない指標を足したいとき）
+#   stat_dashboards : guild_id -> ダッシュボード Embed のメッセージ（チャンネル名の代わりに使える）
+#
+# stats_counters の指標（matching_total / matching_kotsu / gacha_total）はそのまま使える。
+# 例：ブラックジャックの合計を出すチャンネルを足す
+#   INSERT INTO stat_metrics VALUES ('blackjack_total', 'SELECT SUM(amount) FROM blackjack_record');
+#   /統計チャンネル設定 channel:#xxx template:🃏ブラックジャック：{blackjack_total}
+
+CONFIG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stat_channels (
+    channel_id BIGINT PRIMARY KEY,
+    guild_id BIGINT NOT NULL,
+    template TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stat_channels_guild_idx ON stat_channels (guild_id);
+
+CREATE TABLE IF NOT EXISTS stat_metrics (
+    name TEXT PRIMARY KEY,
+    query TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS stat_dashboards (
+    guild_id BIGINT PRIMARY KEY,
+    channel_id BIGINT NOT NULL,
+    message_id BIGINT NOT NULL
+);
+"""
+
+# 以前コードに直書きしていたチャンネル（設定が空のギルドにだけ入れる）
+DEFAULT_CHANNELS = [
+    (1464186246535315564, "👩‍❤️‍💋‍👨マッチ：{matching_total}回｜個通数：{matching_kotsu}"),
+    (1459246559324668057, "🎰ガチャ：{gacha_total}回"),
+]
+
+# Discord のチャンネル名変更は 1チャンネルあたり 10分に2回まで
+RENAME_LIMIT = 2
+RENAME_WINDOW_SEC = 600 + 5  # 時計ずれ分の余裕
+
+
+async def ensure_schema(conn: asyncpg.Connection, guild_id: int | None = None):
+    await conn.execute(CONFIG_SCHEMA)
+    if guild_id is not None and not await conn.fetchval(
+        "SELECT EXISTS (SELECT 1 FROM stat_channels WHERE guild_id = $1)", guild_id
+    ):
+        await conn.executemany(
+            "INSERT INTO stat_channels (channel_id, guild_id, template) VALUES ($1, $2, $3) ON CONFLICT DO NOTHING",
+            [(cid, guild_id, template) for cid, template in DEFAULT_CHANNELS]
+        )
+
+
+def template_fields(template: str) -> set[str]:
+    """template に出てくる指標名。{指標名} 以外の書き方（{0}・{x.y}・{x:,}・閉じていない { など）は ValueError"""
+    names = set()
+    for _, name, spec, conversion in string.Formatter().parse(template):
+        if name is None:
+            continue
+        if not name.isidentifier() or spec or conversion:
+            raise ValueError(f"{{{name}}} のような書き方はできません。{{指標名}} だけ使えます")
+        names.add(name)
+    return names
+
+
+async def known_metrics(conn: asyncpg.Connection) -> set[str]:
+    names = set(await stats_counters.read(conn))
+    names.update(r["name"] for r in await conn.fetch("SELECT name FROM stat_metrics"))
+    return names
+
+
+class _Metrics(dict):
+    """format_map 用。未定義の指標は ? にする"""
+
+    def __missing__(self, key):
+        return "?"
+
+
+async def render_names(conn: asyncpg.Connection, guild_id: int) -> dict[int, str]:
+    """channel_id -> 付けたい名前"""
+    rows = await conn.fetch("SELECT channel_id, template FROM stat_channels WHERE guild_id = $1", guild_id)
+    if not rows:
+        return {}
+
+    metrics = _Metrics(await stats_counters.read(conn))
+    fields: dict[int, set[str]] = {}
+    for r in rows:
+        try:
+            fields[r["channel_id"]] = template_fields(r["template"])
+        except ValueError as e:
+            # 壊れた設定は そのチャンネルだけ飛ばす
+            print(f"❌ stat_channels {r['channel_id']} template error: {e}")
+    used = set().union(*fields.values())
+    custom = [name for name in used if name not in metrics]
+    if custom:
+        for m in await conn.fetch("SELECT name, query FROM stat_metrics WHERE name = ANY($1::text[])", custom):
+            try:
+                metrics[m["name"]] = await conn.fetchval(m["query"])
+            except Exception as e:
+                print(f"❌ stat_metrics {m['name']} error: {e}")
+
+    names = {}
+    for r in rows:
+        if r["channel_id"] not in fields:
+            continue
+        try:
+            names[r["channel_id"]] = r["template"].format_map(metrics)
+        except (ValueError, KeyError, IndexError) as e:
+            print(f"❌ stat_channels {r['channel_id']} render error: {e}")
+    return names
+
+
+class RenameScheduler:
+    """
+    チャンネル名の変更をチャンネルごとにまとめて流す。
+
+    - 同じチャンネルへの要求は最新の名前だけ残す（途中の値は捨てる）
+    - 直近 RENAME_WINDOW_SEC の変更回数を数え、枠が空く時刻まで待ってから変更する
+      （discord.py 側の 429 待ちに入らない）
+    """
+
+    def __init__(self):
+        self._pending: dict[int, tuple[discord.abc.GuildChannel, str]] = {}
+        self._history: dict[int, deque[float]] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+        self.renamed = 0
+        self.coalesced = 0
+
+    def request(self, channel: discord.abc.GuildChannel, name: str):
+        if channel.id in self._pending:
+            self.coalesced += 1
+        elif channel.name == name:
+            return
+        self._pending[channel.id] = (channel, name)
+        if channel.id not in self._workers:
+            self._workers[channel.id] = asyncio.create_task(self._drain(channel.id))
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def next_slot(self, channel_id: int) -> float:
+        """次に変更できるまでの秒数"""
+        history = self._history.get(channel_id)
+        if not history:
+            return 0.0
+        now = time.monotonic()
+        while history and history[0] <= now - RENAME_WINDOW_SEC:
+            history.popleft()
+        if len(history) < RENAME_LIMIT:
+            return 0.0
+        return history[0] + RENAME_WINDOW_SEC - now
+
+    async def _drain(self, channel_id: int):
+        try:
+            while channel_id in self._pending:
+                wait = self.next_slot(channel_id)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+
+                channel, name = self._pending.pop(channel_id)
+                if channel.name == name:
+                    continue
+
+                history = self._history.setdefault(channel_id, deque())
+                history.append(time.monotonic())
+                try:
+                    await channel.edit(name=name)
+                    self.renamed += 1
+                except discord.Forbidden:
+                    print(f"❌ 権限不足でチャンネル名を変更できません: {channel_id}")
+                except discord.HTTPException as e:
+                    print(f"❌ Discord API error: {e}")
+                    if e.status == 429:
+                        # 枠を使い切った扱いにして、次の要求は窓が明けるまで待つ
+                        history.clear()
+                        history.extend([time.monotonic()] * RENAME_LIMIT)
+                        self._pending.setdefault(channel_id, (channel, name))
+        finally:
+            self._workers.pop(channel_id, None)
+
+    def cancel(self):
+        for task in self._workers.values():
+            task.cancel()
+        self._workers.clear()
+        self._pending.clear()
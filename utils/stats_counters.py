@@ -0,0 +1,133 @@
+import asyncpg
+
+# 統計チャンネル用のカウンタ。matching_choose / gacha_log への書き込みをトリガーで拾って加減算する。
+# matching_choose は別の Bot からも書かれるので、アプリ側のフックではなくトリガーで持つ。
+#
+# 1行に集中するとガチャ同士がこの行のロックで直列化するので、接続ごとにシャードを分ける。
+# 読むときは name ごとに SUM する（行数は 指標数 × SHARDS だけ）。
+#
+# gacha_log は古い月を DETACH して集約テーブルへ逃がすが、DETACH は DELETE トリガーを起こさないので
+# gacha_total は「これまでの総回数」のまま変わらない。
+#
+# ここで NOTIFY はしない（NOTIFY したトランザクションのコミットは全体で1本に並ぶので、シャードの意味がなくなる）。
+# 表示側は必要な間隔で read() する。
+
+SHARDS = 8
+
+COUNTERS_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS stats_counters (
+    name TEXT NOT NULL,
+    shard SMALLINT NOT NULL,
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, shard)
+);
+
+CREATE OR REPLACE FUNCTION stats_counters_add(counter TEXT, delta BIGINT) RETURNS void AS $$
+BEGIN
+    IF delta = 0 THEN
+        RETURN;
+    END IF;
+    INSERT INTO stats_counters (name, shard, value)
+    VALUES (counter, pg_backend_pid() % {SHARDS}, delta)
+    ON CONFLICT (name, shard) DO UPDATE SET value = stats_counters.value + EXCLUDED.value;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stats_matching_ins() RETURNS trigger AS $$
+BEGIN
+    PERFORM stats_counters_add('matching_total', (SELECT COUNT(*) FROM new_rows));
+    PERFORM stats_counters_add('matching_kotsu', (SELECT COUNT(*) FROM new_rows WHERE "check" = 1));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stats_matching_del() RETURNS trigger AS $$
+BEGIN
+    PERFORM stats_counters_add('matching_total', -(SELECT COUNT(*) FROM old_rows));
+    PERFORM stats_counters_add('matching_kotsu', -(SELECT COUNT(*) FROM old_rows WHERE "check" = 1));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stats_matching_upd() RETURNS trigger AS $$
+BEGIN
+    PERFORM stats_counters_add(
+        'matching_kotsu',
+        (SELECT COUNT(*) FROM new_rows WHERE "check" = 1) - (SELECT COUNT(*) FROM old_rows WHERE "check" = 1)
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stats_gacha_ins() RETURNS trigger AS $$
+BEGIN
+    PERFORM stats_counters_add('gacha_total', (SELECT COUNT(*) FROM new_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stats_gacha_del() RETURNS trigger AS $$
+BEGIN
+    PERFORM stats_counters_add('gacha_total', -(SELECT COUNT(*) FROM old_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# (テーブル, トリガー名, イベント, 遷移テーブル, 関数)。文単位トリガーなので一括 INSERT でも1回だけ動く
+_TRIGGERS = [
+    ("matching_choose", "stats_matching_ins_trg", "INSERT", "NEW TABLE AS new_rows", "stats_matching_ins"),
+    ("matching_choose", "stats_matching_del_trg", "DELETE", "OLD TABLE AS old_rows", "stats_matching_del"),
+    ("matching_choose", "stats_matching_upd_trg", "UPDATE",
+     "OLD TABLE AS old_rows NEW TABLE AS new_rows", "stats_matching_upd"),
+    ("gacha_log", "stats_gacha_ins_trg", "INSERT", "NEW TABLE AS new_rows", "stats_gacha_ins"),
+    ("gacha_log", "stats_gacha_del_trg", "DELETE", "OLD TABLE AS old_rows", "stats_gacha_del"),
+]
+
+# 現役テーブルから数え直す SQL（name, value）
+_REBUILD_SQL = """
+SELECT 'matching_total' AS name, COUNT(*) AS value FROM matching_choose
+UNION ALL
+SELECT 'matching_kotsu', COUNT(*) FROM matching_choose WHERE "check" = 1
+UNION ALL
+SELECT 'gacha_total', (SELECT COUNT(*) FROM gacha_log) + (SELECT COALESCE(SUM(draws), 0) FROM gacha_log_monthly)
+"""
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    """テーブル・関数・トリガーを用意し、カウンタが空なら数え直す"""
+    await conn.execute(COUNTERS_SCHEMA)
+    for table, name, event, referencing, func in _TRIGGERS:
+        exists = await conn.fetchval(
+            "SELECT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = $1 AND tgrelid = $2::regclass)",
+            name, table
+        )
+        if not exists:
+            await conn.execute(
+                f"CREATE TRIGGER {name} AFTER {event} ON {table} "
+                f"REFERENCING {referencing} FOR EACH STATEMENT EXECUTE FUNCTION {func}()"
+            )
+
+    if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM stats_counters)"):
+        await rebuild(conn)
+
+
+async def rebuild(conn: asyncpg.Connection) -> dict[str, int]:
+    """元テーブルから数え直してカウンタを置き換える。数えている間の書き込みは止める"""
+    async with conn.transaction():
+        await conn.execute("LOCK TABLE matching_choose, gacha_log, gacha_log_monthly IN SHARE MODE")
+        await conn.execute("LOCK TABLE stats_counters IN EXCLUSIVE MODE")
+        rows = await conn.fetch(_REBUILD_SQL)
+        await conn.execute("DELETE FROM stats_counters")
+        await conn.executemany(
+            "INSERT INTO stats_counters (name, shard, value) VALUES ($1, 0, $2)",
+            [(r["name"], r["value"]) for r in rows]
+        )
+    print("✅ stats_counters を数え直しました")
+    return {r["name"]: r["value"] for r in rows}
+
+
+async def read(conn: asyncpg.Connection) -> dict[str, int]:
+    rows = await conn.fetch("SELECT name, SUM(value)::bigint AS value FROM stats_counters GROUP BY name")
+    return {r["name"]: r["value"] for r in rows}
+
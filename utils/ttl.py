@@ -0,0 +1,38 @@
+import time
+from collections import deque
+from typing import Hashable
+
+
+class TTLSet:
+    """
+    一定時間だけ覚えておく集合（二重処理防止用）。
+    TTL が全要素共通なので追加順 = 期限順になり、期限切れは先頭から捨てるだけで済む（償却 O(1)）。
+    """
+
+    def __init__(self, ttl: float, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._keys: set[Hashable] = set()
+        self._order: deque[tuple[float, Hashable]] = deque()
+
+    def _expire(self, now: float):
+        order = self._order
+        while order and order[0][0] <= now:
+            self._keys.discard(order.popleft()[1])
+
+    def add(self, key: Hashable) -> bool:
+        """新しく追加できたら True、期限内に既にあれば False"""
+        now = self._clock()
+        self._expire(now)
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        self._order.append((now + self.ttl, key))
+        return True
+
+    def __contains__(self, key: Hashable) -> bool:
+        self._expire(self._clock())
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
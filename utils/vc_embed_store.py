@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+import discord
+
+# VC チャットに出しているプロフィール Embed（個別・ロスター）の記録。再起動後に実際の VC 状態と突き合わせ、
+# 残っている古い Embed をまとめて消したり、ロスターをそのまま編集し続けたりするために使う。
+
+EMBEDS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vc_profile_embeds (
+    guild_id BIGINT NOT NULL,
+    member_id BIGINT NOT NULL,
+    channel_id BIGINT NOT NULL,
+    message_id BIGINT NOT NULL,
+    posted_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (guild_id, member_id)
+);
+CREATE TABLE IF NOT EXISTS vc_profile_rosters (
+    channel_id BIGINT PRIMARY KEY,
+    guild_id BIGINT NOT NULL,
+    message_id BIGINT NOT NULL,
+    posted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# 一括削除は作成から14日以内のメッセージだけ・1回100件まで
+BULK_DELETE_MAX_AGE = timedelta(days=14) - timedelta(minutes=5)
+BULK_DELETE_CHUNK = 100
+
+
+class VCEmbedStore:
+    def __init__(self, pool: asyncpg.Pool):
+        self.pool = pool
+
+    async def ensure_schema(self):
+        async with self.pool.acquire() as conn:
+            await conn.execute(EMBEDS_SCHEMA)
+
+    async def save(self, guild_id: int, member_id: int, channel_id: int, message_id: int):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO vc_profile_embeds (guild_id, member_id, channel_id, message_id) VALUES ($1, $2, $3, $4)
+                ON CONFLICT (guild_id, member_id) DO UPDATE
+                    SET channel_id = EXCLUDED.channel_id, message_id = EXCLUDED.message_id, posted_at = now()
+                """,
+                guild_id, member_id, channel_id, message_id
+            )
+
+    async def remove(self, guild_id: int, member_id: int, message_id: int):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "DELETE FROM vc_profile_embeds WHERE guild_id = $1 AND member_id = $2 AND message_id = $3",
+                guild_id, member_id, message_id
+            )
+
+    async def load(self):
+        async with self.pool.acquire() as conn:
+            return await conn.fetch("SELECT guild_id, member_id, channel_id, message_id FROM vc_profile_embeds")
+
+    async def save_roster(self, guild_id: int, channel_id: int, message_id: int):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO vc_profile_rosters (channel_id, guild_id, message_id) VALUES ($1, $2, $3)
+                ON CONFLICT (channel_id) DO UPDATE SET message_id = EXCLUDED.message_id, posted_at = now()
+                """,
+                channel_id, guild_id, message_id
+            )
+
+    async def remove_roster(self, channel_id: int, message_id: int):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "DELETE FROM vc_profile_rosters WHERE channel_id = $1 AND message_id = $2",
+                channel_id, message_id
+            )
+
+    async def load_rosters(self):
+        async with self.pool.acquire() as conn:
+            return await conn.fetch("SELECT guild_id, channel_id, message_id FROM vc_profile_rosters")
+
+    async def remove_many(self, message_ids: list[int]):
+        """個別 Embed・ロスターのどちらの行でも消す"""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                WITH e AS (DELETE FROM vc_profile_embeds WHERE message_id = ANY($1::bigint[]))
+                DELETE FROM vc_profile_rosters WHERE message_id = ANY($1::bigint[])
+                """,
+                message_ids
+            )
+
+
+async def store_call(coro):
+    """DB への記録は失敗しても Embed の処理は止めない"""
+    try:
+        await coro
+    except Exception as e:
+        print(f"❌ VC Embed の記録に失敗: {e}")
+
+
+async def purge_messages(channel, message_ids: list[int]) -> int:
+    """message_ids をできるだけ一括削除する。消せた（既に無かった分を含む）件数を返す"""
+    cutoff = discord.utils.time_snowflake(datetime.now(timezone.utc) - BULK_DELETE_MAX_AGE)
+    recent = [mid for mid in message_ids if mid >= cutoff]
+    old = [mid for mid in message_ids if mid < cutoff]
+    purged = 0
+
+    for i in range(0, len(recent), BULK_DELETE_CHUNK):
+        chunk = recent[i:i + BULK_DELETE_CHUNK]
+        try:
+            await channel.delete_messages([discord.Object(id=mid) for mid in chunk])
+            purged += len(chunk)
+        except discord.HTTPException as e:
+            # 既に消えているものが混ざっていると一括削除ごと失敗するので、その束は1件ずつ
+            print(f"⚠️ 一括削除失敗（1件ずつ削除します）: {e}")
+            old.extend(chunk)
+
+    # 14日を過ぎたものは一括削除できない
+    for mid in old:
+        try:
+            await channel.get_partial_message(mid).delete()
+            purged += 1
+        except discord.NotFound:
+            purged += 1
+        except discord.HTTPException as e:
+            print(f"⚠️ Embed削除失敗: {e}")
+    return purged
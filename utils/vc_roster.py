@@ -0,0 +1,180 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+import discord
+
+from utils.embed_pages import pack_embeds
+from utils.vc_embed_store import store_call
+
+# 人数の多い VC 用：メンバーごとに Embed を送る代わりに、VC ごとに1枚のメッセージへ
+# プロフィール Embed を並べ、入退室のたびにそのメッセージを編集する。
+#
+# 入退室は「再描画が必要」という印を付けるだけで、VC ごとのワーカーが ROSTER_SETTLE_SEC 待ってから
+# その時点の VC メンバーで描画する。編集は ROSTER_EDIT_INTERVAL_SEC に1回までで、その間の入退室は
+# 次の1回にまとまる。
+
+ROSTER_SETTLE_SEC = 3.0
+ROSTER_EDIT_INTERVAL_SEC = 10.0
+
+
+@dataclass
+class _Board:
+    channel: discord.VoiceChannel
+    message_id: int | None = None
+    page: int = 0
+    pages: list[list[discord.Embed]] = field(default_factory=list)
+    members: int = 0
+    dirty: bool = False
+    last_write: float = 0.0
+    worker: asyncio.Task | None = None
+
+    def header(self) -> str:
+        text = f"🎧 {self.channel.name}：{self.members}人"
+        if len(self.pages) > 1:
+            text += f"（{self.page + 1}/{len(self.pages)}ページ）"
+        return text
+
+
+class RosterView(discord.ui.View):
+    """ロスターのページ送り。全ロスター共通の永続ビューで、押されたメッセージから VC を引く"""
+
+    def __init__(self, roster: "VCRoster"):
+        super().__init__(timeout=None)
+        self.roster = roster
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary, custom_id="vc_roster:prev")
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.roster.turn_page(interaction, -1)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary, custom_id="vc_roster:next")
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.roster.turn_page(interaction, 1)
+
+
+class VCRoster:
+    """
+    build(member) -> Embed | None でメンバーの Embed を作る。store（VCEmbedStore）を渡すとメッセージ ID を DB に残す。
+
+    coalesced : 描画待ちの間に来て、次の1回にまとめられた入退室の数
+    """
+
+    def __init__(self, build, store=None):
+        self._build = build
+        self.store = store
+        self.boards: dict[int, _Board] = {}
+        self._by_message: dict[int, int] = {}  # message_id -> channel_id
+        self.view = RosterView(self)
+        self.sends = 0
+        self.edits = 0
+        self.deletes = 0
+        self.coalesced = 0
+
+    def restore(self, channel: discord.VoiceChannel, message_id: int):
+        """再起動前に出していたロスターを、以後も編集するメッセージとして登録する"""
+        board = self.boards.setdefault(channel.id, _Board(channel))
+        board.message_id = message_id
+        self._by_message[message_id] = channel.id
+
+    def touch(self, channel: discord.VoiceChannel):
+        """channel のメンバーが変わった"""
+        board = self.boards.setdefault(channel.id, _Board(channel))
+        board.channel = channel
+        if board.dirty:
+            self.coalesced += 1
+        board.dirty = True
+        if board.worker is None:
+            board.worker = asyncio.create_task(self._drain(channel.id))
+
+    async def _drain(self, channel_id: int):
+        board = self.boards[channel_id]
+        try:
+            await asyncio.sleep(ROSTER_SETTLE_SEC)
+            while board.dirty:
+                wait = board.last_write + ROSTER_EDIT_INTERVAL_SEC - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                board.dirty = False
+                await self._render(board)
+        finally:
+            board.worker = None
+            if board.message_id is None and not board.dirty:
+                self.boards.pop(channel_id, None)
+
+    async def _render(self, board: _Board):
+        channel = board.channel
+        members = list(channel.members)
+        embeds = [e for e in await asyncio.gather(*(self._build(m) for m in members)) if e is not None]
+        board.members = len(members)
+        board.pages = pack_embeds(embeds)
+        board.page = min(board.page, max(len(board.pages) - 1, 0))
+
+        if not board.pages:
+            await self._delete(board)
+            return
+
+        kwargs = dict(
+            content=board.header(),
+            embeds=board.pages[board.page],
+            view=self.view if len(board.pages) > 1 else None,
+        )
+        board.last_write = time.monotonic()
+        if board.message_id is not None:
+            try:
+                await channel.get_partial_message(board.message_id).edit(**kwargs)
+                self.edits += 1
+                return
+            except discord.NotFound:
+                # 誰かに消されていたら出し直す
+                self._by_message.pop(board.message_id, None)
+                board.message_id = None
+            except discord.HTTPException as e:
+                print(f"⚠️ ロスター編集失敗: {e}")
+                if e.status == 429:
+                    board.dirty = True
+                return
+
+        try:
+            sent = await channel.send(**kwargs)
+        except discord.HTTPException as e:
+            print(f"❌ ロスター送信失敗: {e}")
+            return
+        self.sends += 1
+        board.message_id = sent.id
+        self._by_message[sent.id] = channel.id
+        print(f"✅ ロスター送信完了: channel={channel.id} message_id={sent.id}")
+        if self.store is not None:
+            await store_call(self.store.save_roster(channel.guild.id, channel.id, sent.id))
+
+    async def _delete(self, board: _Board):
+        message_id = board.message_id
+        if message_id is None:
+            return
+        board.message_id = None
+        self._by_message.pop(message_id, None)
+        try:
+            await board.channel.get_partial_message(message_id).delete()
+            self.deletes += 1
+        except discord.NotFound:
+            pass
+        except discord.HTTPException as e:
+            print(f"⚠️ ロスター削除失敗: {e}")
+        if self.store is not None:
+            await store_call(self.store.remove_roster(board.channel.id, message_id))
+
+    async def turn_page(self, interaction: discord.Interaction, delta: int):
+        channel_id = self._by_message.get(interaction.message.id)
+        board = self.boards.get(channel_id) if channel_id else None
+        if board is None or not board.pages:
+            await interaction.response.send_message("このロスターは更新待ちです。少し待ってからもう一度押してください。", ephemeral=True)
+            return
+        # インタラクションへの応答で編集するので、チャンネルの編集枠は使わない
+        board.page = (board.page + delta) % len(board.pages)
+        await interaction.response.edit_message(content=board.header(), embeds=board.pages[board.page], view=self.view)
+
+    def cancel(self):
+        for board in self.boards.values():
+            if board.worker:
+                board.worker.cancel()
+        self.view.stop()
@@ -0,0 +1,131 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+import discord
+
+from utils.vc_embed_store import store_call
+
+# VC 入退室・移動ごとのプロフィール Embed をメンバー単位でまとめる。
+#
+# イベントが来るたびに「今いるべき VC」だけ更新し、SETTLE_SEC 静かになったら
+# （または最初のイベントから MAX_DELAY_SEC 経ったら）表示中の Embed と見比べて差分だけ API を叩く。
+# 出入りを繰り返しても、落ち着いた時点で同じ VC にいれば何もしない。
+
+SETTLE_SEC = 3.0
+MAX_DELAY_SEC = 15.0
+
+
+@dataclass
+class _MemberState:
+    member: discord.Member
+    target: discord.abc.GuildChannel | None = None   # 今いるべき VC（無視 VC・退出は None）
+    shown: tuple[int, int] | None = None              # 表示中の (channel_id, message_id)
+    first_event_at: float | None = None
+    timer: asyncio.Task | None = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class VoiceEmbedTracker:
+    """
+    send(member, channel) -> message_id | None で Embed を送り、削除は PartialMessage で行う（fetch しない）。
+    store（VCEmbedStore）を渡すと、出した・消した Embed を DB にも書く。
+
+    coalesced  : 反映待ちの間に来て、まとめられたイベント数
+    suppressed : イベントごとに即送信・即削除していた場合と比べて減った API 呼び出し数
+    """
+
+    def __init__(self, send, store=None):
+        self._send = send
+        self.store = store
+        self.states: dict[tuple[int, int], _MemberState] = {}
+        self.coalesced = 0
+        self.suppressed = 0
+        self.rest_calls = 0
+
+    def shown(self, guild_id: int, member_id: int) -> tuple[int, int] | None:
+        st = self.states.get((guild_id, member_id))
+        return st.shown if st else None
+
+    def restore(self, member: discord.Member, channel_id: int, message_id: int):
+        """再起動前に出していた Embed を表示中として登録する"""
+        st = self.states.setdefault((member.guild.id, member.id), _MemberState(member))
+        st.shown = (channel_id, message_id)
+
+    def on_event(
+        self,
+        member: discord.Member,
+        before: discord.abc.GuildChannel | None,
+        after: discord.abc.GuildChannel | None,
+        naive_calls: int,
+    ):
+        """after は無視対象なら None で渡す。naive_calls は即時処理なら叩いていた API 回数"""
+        key = (member.guild.id, member.id)
+        st = self.states.get(key)
+        if st is None:
+            st = self.states[key] = _MemberState(member)
+        st.member = member
+        st.target = after
+        self.suppressed += naive_calls
+
+        now = time.monotonic()
+        if st.timer and not st.timer.done():
+            self.coalesced += 1
+            st.timer.cancel()
+        else:
+            st.first_event_at = now
+        delay = min(SETTLE_SEC, max(0.0, st.first_event_at + MAX_DELAY_SEC - now))
+        st.timer = asyncio.create_task(self._settle_later(key, delay))
+
+    async def _settle_later(self, key, delay: float):
+        await asyncio.sleep(delay)
+        st = self.states.get(key)
+        if st is None:
+            return
+        st.timer = None
+        async with st.lock:
+            await self._settle(key, st)
+
+    async def _settle(self, key, st: _MemberState):
+        target = st.target
+        if st.shown and target and st.shown[0] == target.id:
+            return
+
+        deleted: int | None = None
+        if st.shown:
+            channel_id, deleted = st.shown
+            st.shown = None
+            channel = st.member.guild.get_channel(channel_id)
+            if channel is not None:
+                self._count_call()
+                try:
+                    await channel.get_partial_message(deleted).delete()
+                    print(f"🗑️ Embed削除: message_id={deleted}")
+                except discord.NotFound:
+                    pass
+                except discord.HTTPException as e:
+                    print(f"⚠️ Embed削除失敗: {e}")
+
+        sent = await self._send(st.member, target) if target is not None else None
+        if sent:
+            self._count_call()
+            st.shown = (target.id, sent)
+
+        if self.store is not None:
+            # 送れたら行を差し替え、消しただけなら行を消す
+            if sent:
+                await store_call(self.store.save(key[0], key[1], target.id, sent))
+            elif deleted:
+                await store_call(self.store.remove(key[0], key[1], deleted))
+
+        if st.shown is None and st.timer is None:
+            self.states.pop(key, None)
+
+    def _count_call(self):
+        self.rest_calls += 1
+        self.suppressed -= 1
+
+    def cancel(self):
+        for st in self.states.values():
+            if st.timer:
+                st.timer.cancel()
@@ -0,0 +1,116 @@
+import asyncpg
+
+# 提供者への入金は wallet を直接更新せず、追記専用の台帳に積む。
+# wallet.balance へは compact() がまとめて畳み込む。
+#
+# ロック順は常に「wallet 行 → 台帳行」：
+#   - 購入者は自分の wallet 行を FOR UPDATE してから自分宛ての台帳行を畳む
+#   - compact() は対象ユーザーの wallet 行を user_id 順に確保してから台帳行を消す
+LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS wallet_credit_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    amount INTEGER NOT NULL,
+    pulls INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS wallet_credit_ledger_user_idx ON wallet_credit_ledger (user_id);
+"""
+
+# compact() を同時に1本だけ走らせるためのアドバイザリロックキー
+COMPACT_LOCK_KEY = 0x6A11E7
+
+
+async def ensure_schema(conn: asyncpg.Connection):
+    await conn.execute(LEDGER_SCHEMA)
+
+
+async def fold_pending(conn: asyncpg.Connection, user_id: int, debit: int = 0) -> int | None:
+    """
+    user_id 宛ての未反映クレジットを wallet に取り込み、debit を引き落として新しい残高を返す。
+    呼び出し側で wallet 行を FOR UPDATE 済みであること。
+    """
+    return await conn.fetchval(
+        """
+        WITH moved AS (
+            DELETE FROM wallet_credit_ledger
+            WHERE user_id = $1
+            RETURNING amount, pulls
+        ),
+        pulls AS (
+            INSERT INTO gacha_provider_pulls (provider_id, pull_count)
+            SELECT $1, SUM(pulls) FROM moved
+            HAVING COALESCE(SUM(pulls), 0) > 0
+            ON CONFLICT (provider_id)
+            DO UPDATE SET pull_count = gacha_provider_pulls.pull_count + EXCLUDED.pull_count
+        )
+        UPDATE wallet
+        SET balance = balance - $2 + COALESCE((SELECT SUM(amount) FROM moved), 0)
+        WHERE user_id = $1
+        RETURNING balance
+        """,
+        user_id, debit
+    )
+
+
+async def pending_pulls(conn: asyncpg.Connection, user_id: int) -> int:
+    return await conn.fetchval(
+        "SELECT COALESCE(SUM(pulls), 0) FROM wallet_credit_ledger WHERE user_id = $1",
+        user_id
+    )
+
+
+async def compact(pool: asyncpg.Pool, limit: int = 5000) -> int:
+    """台帳の古い行から最大 limit 件分のユーザーを wallet に畳み込む。処理した台帳行数を返す"""
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if not await conn.fetchval("SELECT pg_try_advisory_xact_lock($1)", COMPACT_LOCK_KEY):
+                return 0
+
+            user_ids = [
+                r["user_id"]
+                for r in await conn.fetch(
+                    """
+                    SELECT DISTINCT user_id FROM (
+                        SELECT user_id FROM wallet_credit_ledger ORDER BY id LIMIT $1
+                    ) t
+                    """,
+                    limit
+                )
+            ]
+            if not user_ids:
+                return 0
+
+            await conn.execute(
+                "SELECT 1 FROM wallet WHERE user_id = ANY($1::bigint[]) ORDER BY user_id FOR UPDATE",
+                user_ids
+            )
+
+            return await conn.fetchval(
+                """
+                WITH moved AS (
+                    DELETE FROM wallet_credit_ledger
+                    WHERE user_id = ANY($1::bigint[])
+                    RETURNING user_id, amount, pulls
+                ),
+                agg AS (
+                    SELECT user_id, SUM(amount) AS amount, SUM(pulls) AS pulls, COUNT(*) AS n
+                    FROM moved
+                    GROUP BY user_id
+                ),
+                pulls AS (
+                    INSERT INTO gacha_provider_pulls (provider_id, pull_count)
+                    SELECT user_id, pulls FROM agg WHERE pulls > 0 ORDER BY user_id
+                    ON CONFLICT (provider_id)
+                    DO UPDATE SET pull_count = gacha_provider_pulls.pull_count + EXCLUDED.pull_count
+                ),
+                credited AS (
+                    INSERT INTO wallet (user_id, balance)
+                    SELECT user_id, amount FROM agg ORDER BY user_id
+                    ON CONFLICT (user_id)
+                    DO UPDATE SET balance = wallet.balance + EXCLUDED.balance
+                )
+                SELECT COALESCE(SUM(n), 0) FROM agg
+                """,
+                user_ids
+            )